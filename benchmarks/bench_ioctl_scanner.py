@@ -0,0 +1,123 @@
+# Module : Bench_ioctl_scanner.py
+# Description : Compares the ioctl scanner of the Extractor with the previous regex chain on a header tree
+#
+# usage: python benchmarks/bench_ioctl_scanner.py [header dir] [trap prefix] [rounds]
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.extractor import Ioctl, IoctlScanner
+
+LEGACY_REGEX = {
+    "io": re.compile(r"#define\s+(.*)\s+_IO\((.*)\).*"),
+    "iow": re.compile(r"#define\s+(.*)\s+_IOW\((.*),\s+(.*),\s+(.*)\).*"),
+    "ior": re.compile(r"#define\s+(.*)\s+_IOR\((.*),\s+(.*),\s+(.*)\).*"),
+    "iowr": re.compile(r"#define\s+(.*)\s+_IOWR\((.*),\s+(.*),\s+(.*)\).*"),
+    "lnx": re.compile(r"#define\s+[A-Za-z0-9_]+\s+0x[0-9]+", re.IGNORECASE),
+    "lnx_amdkfd_ior": re.compile(r"\s*[A-Za-z0-9]+_IOR\(\s*0x[0-9]*\s*\\*,\s*\\*\s*(.*)", re.IGNORECASE),
+    "lnx_amdkfd_iow": re.compile(r"\s*[A-Za-z0-9]+_IOW\(\s*0x[0-9]*\s*\\*,\s*\\*\s*(.*)", re.IGNORECASE),
+    "lnx_amdkfd_iowr": re.compile(r"\s*[A-Za-z0-9]+_IOWR\(\s*0x[0-9]*\s*\\*,\s*\\*\s*(.*)", re.IGNORECASE)
+}
+
+
+def legacy_scan(files, trap_prefix):
+    """The loop of Extractor.get_ioctls before the scanner, returning what it used to append"""
+    found = []
+    lineCont = ""
+    for file, content in files:
+        for line in content:
+            io_match = LEGACY_REGEX["io"].match(line)
+            if io_match:
+                found.append((file, Ioctl.IO, io_match.groups()[0].strip(), None, 0))
+                continue
+            matched = False
+            for name, gtype in (("ior", Ioctl.IOR), ("iow", Ioctl.IOW), ("iowr", Ioctl.IOWR)):
+                match = LEGACY_REGEX[name].match(line)
+                if match:
+                    found.append((file, gtype, match.groups()[0].strip(), match.groups()[-1], 0))
+                    matched = True
+                    break
+            if matched:
+                continue
+            if LEGACY_REGEX["lnx"].match(line) and trap_prefix is not None:
+                line = line.strip()
+                if trap_prefix in line:
+                    for word in line.split():
+                        if trap_prefix in word:
+                            ioctl_trap = word
+                    found.append((file, Ioctl.LNX, line.split()[1].strip(), None, ioctl_trap))
+                else:
+                    found.append((file, None, None, None, 0))
+                continue
+            if "\\" and "#define" in line:
+                lineCont = line.replace("#define", "")
+                lineCont = lineCont.replace("\\", "")
+                lineCont = lineCont.strip()
+            for name, gtype in (("lnx_amdkfd_ior", Ioctl.IOR), ("lnx_amdkfd_iow", Ioctl.IOW),
+                                ("lnx_amdkfd_iowr", Ioctl.IOWR)):
+                match = LEGACY_REGEX[name].match(line)
+                if match:
+                    found.append((file, gtype, lineCont,
+                                  match.groups()[-1].replace("\\", "").replace(")", "").strip(), 0))
+                    break
+    return found
+
+
+def scanner_scan(files, trap_prefix):
+    found = []
+    scanner = IoctlScanner(2, trap_prefix)
+    for file, content in files:
+        for gtype, command, description, ioctl_trap in scanner.scan(content):
+            found.append((file, gtype, command, description, ioctl_trap))
+    return found
+
+
+def load_headers(path):
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            if name.endswith(".h"):
+                with open(os.path.join(root, name), "r", errors="replace") as fd:
+                    files.append((os.path.relpath(os.path.join(root, name), path), fd.readlines()))
+    return files
+
+
+def best_of(function, files, trap_prefix, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(files, trap_prefix)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "/usr/include/linux"
+    trap_prefix = sys.argv[2] if len(sys.argv) > 2 else None
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    files = load_headers(path)
+    lines = sum(len(content) for _, content in files)
+    print("%d headers, %d lines, best of %d rounds" % (len(files), lines, rounds))
+
+    legacy_time, legacy = best_of(legacy_scan, files, trap_prefix, rounds)
+    scanner_time, scanner = best_of(scanner_scan, files, trap_prefix, rounds)
+    print("legacy regex chain : %8.3f ms, %d ioctls" % (legacy_time * 1000, len(legacy)))
+    print("fused scanner      : %8.3f ms, %d ioctls" % (scanner_time * 1000, len(scanner)))
+    print("speedup            : %8.2fx" % (legacy_time / scanner_time))
+
+    legacy_set = set(legacy)
+    scanner_set = set(scanner)
+    for entry in sorted(legacy_set - scanner_set, key=str):
+        print("only legacy : " + str(entry))
+    for entry in sorted(scanner_set - legacy_set, key=str):
+        print("only scanner: " + str(entry))
+
+
+if __name__ == "__main__":
+    main()
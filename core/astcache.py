@@ -0,0 +1,350 @@
+# Module : Astcache.py
+# Description : Reuse of libclang translation units across the ioctl and syscall analysis
+from collections import OrderedDict, deque, namedtuple
+import logging
+import os
+import threading
+
+import clang.cindex as cindex
+
+from core.cache import hash_file, hash_strings
+
+
+AST_SUFFIX = ".ast"
+COPY_FUNCTIONS = ("copy_from_user", "copy_to_user", "get_user", "put_user")
+COPY_DIRECTIONS = {"copy_from_user": "in", "get_user": "in", "copy_to_user": "out", "put_user": "out"}
+
+FunctionSummary = namedtuple("FunctionSummary", ["copy_function", "direction", "arg_type", "callees"])
+
+
+def is_function_ref(token) -> bool:
+    return token.kind == cindex.TokenKind.IDENTIFIER and token.cursor.kind == cindex.CursorKind.DECL_REF_EXPR \
+        and token.cursor.referenced.kind == cindex.CursorKind.FUNCTION_DECL
+
+
+def copy_arg_type(type_spelling) -> str:
+    """
+    Strip the qualifiers of the type of a user copy argument
+    :return: type name
+    """
+    parts = type_spelling.split(" ")
+    if parts[0] in ("struct", "union", "unsigned"):
+        arg_type = parts[1]
+    else:
+        arg_type = parts[0].replace("*", "").replace("const", "").replace("volatile", "")
+    return arg_type.strip()
+
+
+class CaseLabel(object):
+    """A case statement of a translation unit, the functions it references are collected on first use"""
+    __slots__ = ("tu", "cursor", "extent", "_callees")
+
+    def __init__(self, tu, cursor):
+        self.tu = tu
+        self.cursor = cursor
+        self.extent = cursor.extent
+        self._callees = None
+
+    @property
+    def callees(self) -> list:
+        """
+        DECL_REF_EXPR cursors of the functions referenced in the case statement
+        :return: list of cursors
+        """
+        if self._callees is None:
+            self._callees = []
+            for token in self.tu.get_tokens(extent=self.extent):
+                if is_function_ref(token):
+                    self._callees.append(token.cursor)
+        return self._callees
+
+
+class CaseLabelIndex(object):
+    """
+    Case statements of the main file of a translation unit, built in a single traversal.
+    A case is keyed by the first token of each of its children, which is how ioctl handlers are matched.
+    """
+
+    def __init__(self, tu):
+        self.cases = {}
+        main_file = tu.spelling
+        for top_level in tu.cursor.get_children():
+            # skip everything that comes from included headers
+            if top_level.location.file is None or top_level.location.file.name != main_file:
+                continue
+            for cursor in top_level.walk_preorder():
+                if cursor.kind != cindex.CursorKind.CASE_STMT:
+                    continue
+                if cursor.location.file is None or cursor.location.file.name != main_file:
+                    continue
+                label = CaseLabel(tu, cursor)
+                for child in cursor.get_children():
+                    token = next(iter(child.get_tokens()), None)
+                    if token is not None:
+                        self.cases.setdefault(token.spelling, []).append(label)
+
+    def lookup(self, constant) -> list:
+        """
+        Case statements matching a constant, in traversal order
+        :return: list of CaseLabel
+        """
+        return self.cases.get(constant, [])
+
+
+class CopySummaries(object):
+    """
+    Per function summaries of the user copy calls of a translation unit, keyed by USR so that each
+    function body is tokenized at most once. A summary records the first user copy call of the body
+    with its direction and argument type, and the functions called before it, where the search goes on.
+    The callees are cursors of the unit, so summaries are never shared between units: they are kept
+    with their unit by TranslationUnitCache and dropped when it is evicted.
+    """
+
+    def __init__(self):
+        self.summaries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(func) -> str:
+        usr = func.get_usr()
+        if usr:
+            return usr
+        location = func.location
+        return "%s:%d:%s" % (location.file.name if location.file else "", location.line, func.spelling)
+
+    def summary(self, func, tu) -> FunctionSummary:
+        """
+        Summary of a function, computed from its definition on first use
+        :return: FunctionSummary
+        """
+        key = self.key(func)
+        summary = self.summaries.get(key)
+        if summary is not None:
+            self.hits += 1
+            return summary
+        self.misses += 1
+
+        body = func.get_definition() or func.referenced
+        copy_function = direction = arg_type = None
+        callees = []
+        found_bracket = False
+        # the extent is only meaningful in the unit the cursor comes from
+        for token in body.translation_unit.get_tokens(extent=body.extent):
+            if copy_function is None:
+                if is_function_ref(token):
+                    if token.spelling in COPY_FUNCTIONS:
+                        copy_function = token.spelling
+                        direction = COPY_DIRECTIONS[copy_function]
+                    else:
+                        callees.append(token.cursor)
+            elif not found_bracket:
+                # the destination is the first argument when copying in, the second one when copying out
+                if token.kind == cindex.TokenKind.PUNCTUATION and token.spelling == ("(" if direction == "in" else ","):
+                    found_bracket = True
+            elif token.kind == cindex.TokenKind.IDENTIFIER and token.cursor.kind == cindex.CursorKind.DECL_REF_EXPR:
+                arg_type = copy_arg_type(str(token.cursor.type.spelling))
+                break
+
+        summary = FunctionSummary(copy_function, direction, arg_type, callees)
+        self.summaries[key] = summary
+        return summary
+
+    def search(self, decl_refs, tu) -> FunctionSummary:
+        """
+        Breadth first search of the call graph from the referenced functions, each function is visited once
+        :return: summary of the first function copying a typed argument, or None
+        """
+        queue = deque(decl_refs)
+        visited = set()
+        while queue:
+            func = queue.popleft().referenced
+            key = self.key(func)
+            if key in visited:
+                continue
+            visited.add(key)
+            summary = self.summary(func, tu)
+            if summary.arg_type is not None:
+                return summary
+            queue.extend(summary.callees)
+        return None
+
+
+class TranslationUnitCache(object):
+    """
+    Parses each preprocessed file once per run with a single cindex.Index. The case label index and
+    the copy summaries of a unit are kept with it.
+    Translation units are evicted least recently used first once the preprocessed files they
+    were parsed from add up to more than <max_bytes>, their size is used as a proxy for the AST size.
+    With an <ast_dir>, parsed units are also saved there, keyed by the path and contents of the
+    preprocessed file, and read back by later runs. The directory is kept under <ast_max_bytes>
+    by removing the files that were least recently used.
+    """
+
+    def __init__(self, max_bytes, logger, ast_dir=None, ast_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self.ast_dir = ast_dir
+        self.ast_max_bytes = ast_max_bytes
+        self.index = None
+        self.units = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.ast_hits = 0
+        if self.ast_dir is not None:
+            os.makedirs(self.ast_dir, exist_ok=True)
+
+    def ast_file(self, path) -> str:
+        return os.path.join(self.ast_dir, hash_strings(os.path.realpath(path), hash_file(path)) + AST_SUFFIX)
+
+    def read_ast(self, ast_file):
+        """
+        Load a saved translation unit, libclang refuses it if the preprocessed file was rewritten since
+        :return: TranslationUnit, or None
+        """
+        if not os.path.isfile(ast_file):
+            return None
+        try:
+            tu = cindex.TranslationUnit.from_ast_file(ast_file, self.index)
+        except cindex.TranslationUnitLoadError:
+            self.logger.debug("[*] Discarding stale AST " + ast_file)
+            return None
+        try:
+            os.utime(ast_file)
+        except FileNotFoundError:
+            pass
+        self.ast_hits += 1
+        return tu
+
+    def save_ast(self, tu, ast_file):
+        tmp_file = ast_file + ".tmp"
+        try:
+            tu.save(tmp_file)
+        except cindex.TranslationUnitSaveError:
+            self.logger.warning("[!] Unable to save AST " + ast_file)
+            return
+        os.replace(tmp_file, ast_file)
+        self.trim_ast_dir()
+
+    def trim_ast_dir(self):
+        """
+        Remove the least recently used saved units until the directory fits in ast_max_bytes
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.ast_dir):
+            if entry.name.endswith(AST_SUFFIX) and entry.is_file():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        # the newest unit is kept even if it is larger than the cap
+        entries.sort()
+        for _, size, ast_file in entries[:-1]:
+            if total <= self.ast_max_bytes:
+                break
+            try:
+                os.remove(ast_file)
+            except FileNotFoundError:
+                # removed by another analysis process
+                pass
+            total -= size
+            self.logger.debug("[*] Evicted saved AST " + ast_file)
+
+    def get(self, path) -> cindex.TranslationUnit:
+        """
+        Translation unit of a preprocessed file, read from the AST directory or parsed on first use
+        :return: TranslationUnit
+        """
+        with self.lock:
+            if path in self.units:
+                self.units.move_to_end(path)
+                return self.units[path][0]
+
+            if self.index is None:
+                self.index = cindex.Index.create()
+            tu = None
+            if self.ast_dir is not None:
+                ast_file = self.ast_file(path)
+                tu = self.read_ast(ast_file)
+            if tu is None:
+                self.logger.debug("[*] Parsing translation unit " + path)
+                tu = self.index.parse(path)
+                if self.ast_dir is not None:
+                    self.save_ast(tu, ast_file)
+            size = os.path.getsize(path)
+            self.units[path] = [tu, size, None, CopySummaries()]
+            self.total_bytes += size
+
+            # never evict the unit that was just parsed
+            while self.total_bytes > self.max_bytes and len(self.units) > 1:
+                evicted, entry = self.units.popitem(last=False)
+                self.total_bytes -= entry[1]
+                self.logger.debug("[*] Evicted translation unit " + evicted)
+            return tu
+
+    def case_index(self, path) -> CaseLabelIndex:
+        """
+        Case label index of a preprocessed file, built once per parsed translation unit
+        :return: CaseLabelIndex
+        """
+        tu = self.get(path)
+        with self.lock:
+            entry = self.units.get(path)
+            if entry is None:
+                # evicted in between, index it without caching
+                return CaseLabelIndex(tu)
+            if entry[2] is None:
+                self.logger.debug("[*] Indexing case labels of " + path)
+                entry[2] = CaseLabelIndex(tu)
+            return entry[2]
+
+    def copy_summaries(self, path) -> CopySummaries:
+        """
+        Copy summaries of the functions of a preprocessed file, dropped with its translation unit
+        :return: CopySummaries
+        """
+        self.get(path)
+        with self.lock:
+            entry = self.units.get(path)
+            if entry is None:
+                # evicted in between, the summaries live as long as the search
+                return CopySummaries()
+            return entry[3]
+
+
+def trap_case_summary(case_index, constant, copy_summaries) -> FunctionSummary:
+    """
+    Search the functions called by the case statements handling a constant, the last case decides
+    :return: FunctionSummary, or None
+    """
+    summary = None
+    for case in case_index.lookup(constant):
+        summary = copy_summaries.search(list(case.callees), case.tu)
+    return summary
+
+
+# state of an analysis worker process, created by the first task it runs
+_worker_state = {}
+
+
+def summarize_ioctl_cases(path, constants, ast_dir=None, ast_max_bytes=0) -> dict:
+    """
+    Worker process entry point: the user copy summary of every case label of a preprocessed file
+    handling one of the constants. Each worker process has its own cindex.Index.
+    :return: dict of constant -> "<type> <direction>"
+    """
+    if not _worker_state:
+        logger = logging.getLogger("Descriptions")
+        # a single translation unit is kept parsed, each file is analysed once
+        _worker_state["tu_cache"] = TranslationUnitCache(0, logger, ast_dir, ast_max_bytes)
+    case_index = _worker_state["tu_cache"].case_index(path)
+    copy_summaries = _worker_state["tu_cache"].copy_summaries(path)
+    results = {}
+    for constant in constants:
+        summary = trap_case_summary(case_index, constant, copy_summaries)
+        if summary is not None:
+            results[constant] = summary.arg_type + " " + summary.direction
+    return results
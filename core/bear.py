@@ -2,16 +2,153 @@
 # Description : Contains functions which handle the compilation of a file
 from core.utils import Utils
 from core.logger import get_logger
+from core.cache import FileHasher, Manifest, hash_strings
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 import collections
 import json
+import resource
+import time
 
 INVALID_GCC_FLAGS = ['-mno-thumb-interwork', '-fconserve-stack', '-fno-var-tracking-assignments',
                      '-fno-delete-null-pointer-checks', '--param=allow-store-data-races=0',
                      '-Wno-unused-but-set-variable', '-Werror=frame-larger-than=1', '-Werror', '-Wall',
                      '-fno-jump-tables', '-nostdinc', '-mpc-relative-literal-loads', '-mabi=lp64']
 
+INCLUDE_DIR_FLAGS = ['-isystem', '-idirafter', '-iquote', '-I']
+
+CompilationCommand = collections.namedtuple("CompilationCommand",
+                                            ["curr_args", "work_dir", "src_file", "output_file"])
+
+MANIFEST_NAME = ".bear_manifest.json"
+READ_CHUNK_SIZE = 1 << 20
+
+
+class CompileCommandsReader(object):
+    """
+    Streams the entries of a compile_commands.json file without loading the whole database.
+    Optionally persists an index of the byte range of every entry, grouped by directory,
+    so later runs only decode the entries they need.
+    """
+
+    def __init__(self, path, use_index=False, logger=None):
+        self.path = path
+        self.use_index = use_index
+        self.logger = logger
+        self.index_path = path + ".idx"
+        self.decoder = json.JSONDecoder()
+
+    def iter_entries(self):
+        """
+        Incrementally decodes the database. The file is decoded as latin-1 so that string
+        offsets are byte offsets, entries containing other characters are decoded again as UTF-8.
+        :return: generator of (entry, byte offset, byte length)
+        """
+        with open(self.path, "rb") as fd:
+            buf = ""
+            base = 0
+            pos = 0
+            eof = False
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n[,":
+                    pos += 1
+                if pos < len(buf) and buf[pos] == "]":
+                    return
+                try:
+                    if pos >= len(buf):
+                        raise ValueError("need more data")
+                    entry, end = self.decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        if pos >= len(buf):
+                            return
+                        raise
+                    chunk = fd.read(READ_CHUNK_SIZE)
+                    eof = not chunk
+                    buf = buf[pos:] + chunk.decode("latin-1")
+                    base += pos
+                    pos = 0
+                    continue
+                if not buf[pos:end].isascii():
+                    entry = json.loads(buf[pos:end].encode("latin-1").decode("utf-8"))
+                yield entry, base + pos, end - pos
+                pos = end
+
+    def read_entry(self, fd, offset, length):
+        fd.seek(offset)
+        return json.loads(fd.read(length).decode("utf-8"))
+
+    @staticmethod
+    def entry_dir(entry) -> str:
+        return os.path.dirname(os.path.normpath(os.path.join(entry["directory"], entry["file"])))
+
+    def file_stamp(self) -> list:
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "r") as fd:
+                index = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        if index.get("stamp") != self.file_stamp():
+            return None
+        return index["dirs"]
+
+    def save_index(self, dirs):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as fd:
+            json.dump({"stamp": self.file_stamp(), "dirs": dirs}, fd)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def in_target(directory, target_path) -> bool:
+        """
+        True if a source directory is target_path or lies under it, target_path being a path fragment
+        such as drivers/<name>
+        """
+        return target_path in directory + os.sep
+
+    def matching(self, target_path):
+        """
+        Yields the entries whose source file lies in a directory under target_path. With the index
+        only the directories that match are looked up, and only their entries are read.
+        :return: generator of entries
+        """
+        if not self.use_index:
+            for entry, _, _ in self.iter_entries():
+                if self.in_target(self.entry_dir(entry), target_path):
+                    yield entry
+            return
+
+        dirs = self.load_index()
+        if dirs is None:
+            dirs = {}
+            for entry, offset, length in self.iter_entries():
+                directory = self.entry_dir(entry)
+                dirs.setdefault(directory, []).append([entry["file"], offset, length])
+                if self.in_target(directory, target_path):
+                    yield entry
+            try:
+                self.save_index(dirs)
+            except OSError as e:
+                # a read only source tree, the index is rebuilt by the next run
+                if self.logger is not None:
+                    self.logger.warning("[!] Unable to save the compile_commands index: " + str(e))
+            return
+
+        selected = []
+        for directory, entries in dirs.items():
+            if self.in_target(directory, target_path):
+                selected.extend(entries)
+        # in database order, like the streamed entries
+        selected.sort(key=lambda entry: entry[1])
+        with open(self.path, "rb") as fd:
+            for _, offset, length in selected:
+                yield self.read_entry(fd, offset, length)
+
 
 class Bear(object):
     def __init__(self, sysobj):
@@ -19,46 +156,191 @@ class Bear(object):
         self.target = self.sysobj.target
         self.compile_commands = self.sysobj.compile_commands
         self.verbosity = self.sysobj.log_level
-
+        self.jobs = self.sysobj.jobs
+        self.use_cache = self.sysobj.use_cache
         self.logger = get_logger("Bear", self.verbosity)
+        self.reader = CompileCommandsReader(self.compile_commands, self.sysobj.compile_commands_index, self.logger)
         self.output_path = os.path.join(os.getcwd(), "out/", self.sysobj.os, "preprocessed/")
+        self.manifest = None
+        self.hasher = FileHasher()
+        self.cache_hits = 0
+        # compile_commands.json entries of the target, shared by header discovery and preprocessing
+        self.target_entries = {}
+        # name of each preprocessed file, without extension -> file name of its source
+        self.source_names = {}
 
-    def compile_target(self, compilation_commands) -> bool:
+    @staticmethod
+    def dep_file(curr_command) -> str:
+        return curr_command.output_file + ".d"
+
+    def read_deps(self, curr_command) -> list:
         """
-        Generates preprocessed files.
-        :return: True
+        Reads the make style dependency list written by gcc alongside the preprocessed file
+        :return: list of absolute paths, or None if the list is unavailable
         """
+        try:
+            with open(self.dep_file(curr_command), "r") as fd:
+                content = fd.read()
+        except IOError:
+            return None
+        content = content.replace("\\\n", " ")
+        deps = content.split(":", 1)[-1].split()
+        return sorted(set(os.path.normpath(os.path.join(curr_command.work_dir, dep)) for dep in deps))
 
-        for curr_command in compilation_commands:
-            self.logger.debug("[*] Initialising the environment " + curr_command[1])
-            Utils(curr_command[1]).run_cmd(f"{' '.join(curr_command[0])} > {curr_command[3]}", doexit=True)
+    def deps_hash(self, deps) -> str:
+        return hash_strings(*[dep + "=" + str(self.hasher(dep)) for dep in deps])
+
+    def cache_key(self, curr_command) -> tuple:
+        """
+        Key of a compilation: the normalized argument vector and the contents of the source file
+        :return: (args hash, source hash)
+        """
+        src_path = os.path.join(curr_command.work_dir, curr_command.src_file)
+        return hash_strings(curr_command.work_dir, *curr_command.curr_args), self.hasher(src_path)
+
+    def is_up_to_date(self, curr_command, key) -> bool:
+        entry = self.manifest.get(curr_command.output_file)
+        if entry is None or not os.path.isfile(curr_command.output_file):
+            return False
+        if entry["args"] != key[0] or entry["source"] != key[1] or key[1] is None:
+            return False
+        return entry["deps_hash"] == self.deps_hash(entry["deps"])
+
+    def preprocess(self, curr_command) -> bool:
+        """
+        Runs the preprocessor for a single compilation command, unless its output is up to date
+        :return: True if the preprocessed file is available
+        """
+        if self.manifest is not None:
+            key = self.cache_key(curr_command)
+            if self.is_up_to_date(curr_command, key):
+                self.logger.debug("[*] Up to date " + curr_command.output_file)
+                self.cache_hits += 1
+                return True
+            self.manifest.discard(curr_command.output_file)
+
+        self.logger.debug("[*] Initialising the environment " + curr_command.work_dir)
+        command = f"{' '.join(curr_command.curr_args)} -MD -MF {self.dep_file(curr_command)} > {curr_command.output_file}"
+        if not Utils(curr_command.work_dir).run_cmd(command):
+            # the shell created the output before gcc failed, later passes would pick it up
+            for path in (curr_command.output_file, self.dep_file(curr_command)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return False
+
+        if self.manifest is not None:
+            deps = self.read_deps(curr_command)
+            if deps is not None:
+                self.manifest.set(curr_command.output_file, {"args": key[0], "source": key[1], "deps": deps,
+                                                             "deps_hash": self.deps_hash(deps)})
         return True
 
-    def parse_compile_commands(self, target_path=None) -> bool:
+    def compile_target(self, compilation_commands) -> bool:
         """
-        Parses commands recorded by bear
-        :return:
+        Generates preprocessed files, running up to self.jobs compiler processes at once.
+        :return: True if at least one file was preprocessed
         """
-        CompilationCommand = collections.namedtuple("CompilationCommand",
-                                                    ["curr_args", "work_dir", "src_file", "output_file"])
-        commands = []
+        failed = []
+        self.cache_hits = 0
+        if self.use_cache and compilation_commands:
+            output_dir = os.path.dirname(compilation_commands[0].output_file)
+            self.manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+        start_wall = time.monotonic()
+        start_cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            results = pool.map(self.preprocess, compilation_commands)
+            for curr_command, done in zip(compilation_commands, results):
+                if not done:
+                    failed.append(curr_command.src_file)
+
+        end_cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall_time = time.monotonic() - start_wall
+        cpu_time = (end_cpu.ru_utime - start_cpu.ru_utime) + (end_cpu.ru_stime - start_cpu.ru_stime)
+        self.logger.info("[+] Preprocessed %d/%d files with %d jobs: %.2fs wall, %.2fs cpu",
+                         len(compilation_commands) - len(failed), len(compilation_commands), self.jobs,
+                         wall_time, cpu_time)
+        if self.manifest is not None:
+            self.manifest.save()
+            self.logger.info("[+] Reused %d up to date preprocessed files", self.cache_hits)
 
+        for src_file in failed:
+            self.logger.error("[!] Failed to preprocess " + src_file)
+        return len(failed) < len(compilation_commands)
+
+    def target_filter(self) -> str:
+        """
+        Part of the source paths of the ioctl target in compile_commands.json
+        :return: path fragment
+        """
+        target_name = os.path.basename(self.target)
+        if self.sysobj.os_type == 1:
+            return "/dev/" + target_name
+        return "drivers/" + target_name
+
+    def matching_entries(self, target_path) -> list:
+        """
+        Entries of compile_commands.json for the sources under target_path, read once per target
+        :return: list of entries
+        """
+        if target_path not in self.target_entries:
+            self.target_entries[target_path] = list(self.reader.matching(target_path))
+        return self.target_entries[target_path]
+
+    def include_dirs(self) -> list:
+        """
+        Include directories passed to the compiler for the sources of the ioctl target
+        :return: list of absolute paths, in command line order
+        """
+        dirs = []
         try:
-            self.logger.debug("[*] Parsing compile_commands.json")
-            fp = open(self.compile_commands, "r")
-            all_cont = fp.read()
-            fp.close()
+            for entry in self.matching_entries(self.target_filter()):
+                args = entry.get("arguments") or entry.get("command", "").split()
+                i = 0
+                while i < len(args):
+                    arg = args[i]
+                    for flag in INCLUDE_DIR_FLAGS:
+                        if arg.startswith(flag):
+                            path = arg[len(flag):]
+                            if not path and i + 1 < len(args):
+                                i += 1
+                                path = args[i]
+                            path = os.path.normpath(os.path.join(entry["directory"], path))
+                            if path not in dirs and os.path.isdir(path):
+                                dirs.append(path)
+                            break
+                    i += 1
         except IOError:
             self.logger.error("Unable to open compile_commands file for reading")
-            return False
+        return dirs
+
+    @staticmethod
+    def output_name(output_path, work_dir, src_file, taken) -> str:
+        """
+        Preprocessed file of a source, named after it. Sources sharing a name, a/foo.c and b/foo.c or foo.c
+        and foo.S, would run into the same file concurrently: the later ones get a short hash of their path.
+        :return: path of the .i file
+        """
+        stem = src_file.split("/")[-1].split(".")[0]
+        output_file = output_path + "/" + stem + ".i"
+        n = 0
+        while output_file in taken:
+            output_file = output_path + "/" + stem + "_" + hash_strings(work_dir, src_file, n)[:8] + ".i"
+            n += 1
+        return output_file
+
+    def parse_compile_commands(self, target_path=None) -> bool:
+        """
+        Parses commands recorded by bear
+        :return:
+        """
+        commands = []
 
-        json_obj = json.loads(all_cont)
         if self.sysobj.input_type == "ioctl":
             target_name = os.path.basename(self.target)
-            if self.sysobj.os_type == 1:
-                target_path = "/dev/" + target_name
-            elif self.sysobj.os_type == 2:
-                target_path = "drivers/" + target_name
+            target_path = self.target_filter()
         else:
             target_name = self.target
 
@@ -67,12 +349,18 @@ class Bear(object):
         if not Utils.dir_exists(output_path):
             os.makedirs(output_path)
         flag = 0
+        output_files = set()
 
-        for curr_command in json_obj:
-            src_file = curr_command["file"]
-            if target_path in src_file:
+        try:
+            self.logger.debug("[*] Parsing compile_commands.json")
+            if self.sysobj.input_type == "ioctl":
+                entries = self.matching_entries(target_path)
+            else:
+                entries = self.reader.matching(target_path)
+            for curr_command in entries:
+                src_file = curr_command["file"]
                 flag = 1
-                curr_args = curr_command["arguments"]
+                curr_args = list(curr_command["arguments"])
                 args = []
                 i = 0
                 # convert each string in the argument into a python friendly escaped string.
@@ -89,9 +377,14 @@ class Bear(object):
                     i += 1
                 curr_args[0] += (" -fdirectives-only -E")
                 work_dir = curr_command["directory"]
-                output_file = output_path + "/" + src_file.split("/")[-1].split(".")[0] + ".i"
+                output_file = self.output_name(output_path, work_dir, src_file, output_files)
+                output_files.add(output_file)
+                self.source_names[os.path.basename(output_file)[:-2]] = os.path.basename(src_file)
                 self.logger.debug("[*] Extracting commands for " + src_file.split("/")[-1])
                 commands.append(CompilationCommand(curr_args, work_dir, src_file, output_file))
+        except IOError:
+            self.logger.error("Unable to open compile_commands file for reading")
+            return False
 
         if flag == 0:
             self.logger.error("Unable to find the target in compile_commands.json")
@@ -2,10 +2,34 @@
 # Description : Run C2xml and verify the results
 from core.utils import *
 from core.logger import get_logger
+from core.cache import Manifest, hash_file, hash_strings
 
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join, basename, isdir, isfile, exists
-from lxml import etree
+import xml.etree.ElementTree as ET
+import json
 import os
+import subprocess
+
+MANIFEST_NAME = ".c2xml_manifest.json"
+
+
+def idents_file(xml_file) -> str:
+    """Path of the list of top level identifiers recorded for an XML file"""
+    return xml_file[:-4] + ".idents"
+
+
+def read_idents(xml_file):
+    """
+    Read the top level identifiers recorded for an XML file
+    :return: list of identifiers, or None if they were not recorded
+    """
+    try:
+        with open(idents_file(xml_file), "r") as fd:
+            return json.load(fd)
+    except (IOError, ValueError):
+        return None
+
 
 class C2xml(object):
     def __init__(self, sysobj):
@@ -15,14 +39,70 @@ class C2xml(object):
         else:
             self.target = "syscalls"
         self.output_path = sysobj.out_dir
+        self.jobs = sysobj.jobs
+        self.timeout = sysobj.c2xml_timeout
+        self.use_cache = sysobj.use_cache
+        self.manifest = None
+        self.c2xml_hash = None
         self.logger = get_logger("C2xml", sysobj.log_level)
 
+    def cache_key(self, preprocessed_path, filename):
+        source_hash = hash_file(join(preprocessed_path, filename))
+        if source_hash is None:
+            return None
+        return hash_strings(self.c2xml_hash, source_hash)
+
+    def convert(self, preprocessed_path, filename):
+        """
+        Convert a single preprocessed file, removing the output if it can't be used
+        :return: (True if the XML file is available, True if it was reused from the cache)
+        """
+        out_file = join(self.output_path, filename.split(".")[0] + ".xml")
+        key = None
+        if self.manifest is not None:
+            key = self.cache_key(preprocessed_path, filename)
+            if key is not None and self.manifest.get(filename) == key and exists(out_file) \
+                    and exists(idents_file(out_file)):
+                self.logger.debug("[+] " + filename + " is unchanged, reusing its XML")
+                return True, True
+            self.manifest.discard(filename)
+
+        if self.generate(preprocessed_path, filename, out_file):
+            if key is not None:
+                self.manifest.set(filename, key)
+            return True, False
+
+        for stale_file in (out_file, idents_file(out_file)):
+            if exists(stale_file):
+                os.remove(stale_file)
+        return False, False
+
+    def generate(self, preprocessed_path, filename, out_file):
+        """
+        Run c2xml on a single preprocessed file
+        :return: True if the XML file was generated and verified
+        """
+        try:
+            with open(out_file, "w") as fd:
+                proc = subprocess.run([join(os.getcwd(), "c2xml"), filename], cwd=preprocessed_path, stdout=fd,
+                                      timeout=self.timeout)
+            if proc.returncode < 0:
+                self.logger.error("[!] c2xml crashed on %s (signal %d)", filename, -proc.returncode)
+            elif self.verify_xml(out_file, self.sysobj.descriptions.wants_xml(basename(out_file))):
+                self.logger.debug("[+] " + filename + " converted to XML and verified!")
+                return True
+        except subprocess.TimeoutExpired:
+            self.logger.error("[!] c2xml timed out after %ss on %s", self.timeout, filename)
+        except OSError as e:
+            self.logger.error(e)
+            self.logger.error("[!] Unable to run c2xml on " + filename)
+        return False
+
     def run_c2xml(self):
         """
-        Execute c2xml command
-        :return:
+        Execute c2xml command on every preprocessed file, up to self.jobs at once
+        :return: True if at least one file was converted
         """
-        cwd = os.getcwd()
         if self.sysobj.input_type == "ioctl":
             preprocessed_path = join(os.getcwd(), "out/", self.sysobj.os, "preprocessed/", basename(self.target))
         else:
@@ -30,23 +110,58 @@ class C2xml(object):
 
         if not dir_exists(self.output_path):
             os.makedirs(self.output_path)
-        for filename in os.listdir(preprocessed_path):
-            if filename.endswith('.i'):
-                out_file = join(self.output_path, filename.split(".")[0] + ".xml")
-                Utils(preprocessed_path).run_cmd(cwd + "/c2xml " + filename + " > " + out_file)
-                if (self.verify_xml(out_file)):
-                    self.logger.debug("[+] " + filename + " converted to XML and verified!")
-                else:
-                    return False
+        filenames = [filename for filename in os.listdir(preprocessed_path) if filename.endswith('.i')]
+        if self.use_cache:
+            self.manifest = Manifest(join(self.output_path, MANIFEST_NAME))
+            self.c2xml_hash = hash_file(join(os.getcwd(), "c2xml"))
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            results = list(pool.map(lambda filename: self.convert(preprocessed_path, filename), filenames))
+
+        if self.manifest is not None:
+            self.manifest.save()
+            hits = sum(1 for done, cached in results if cached)
+            self.logger.info("[+] c2xml cache: %d hits, %d misses", hits, len(filenames) - hits)
+
+        failed = [filename for filename, (done, cached) in zip(filenames, results) if not done]
+        for filename in failed:
+            self.logger.warning("[!] Skipping " + filename + ", no usable XML was generated")
+        self.logger.info("[+] Converted %d/%d files to XML", len(filenames) - len(failed), len(filenames))
         self.logger.debug("[+] Generated XML files for corresponding C code.")
+        return len(failed) < len(filenames) or not filenames
 
-    def verify_xml(self, xml_to_check):
-        # Verify whether the output has whatever we expected
+    def verify_xml(self, xml_to_check, keep=False):
+        """
+        Streams the XML file to check that it is well formed. Top level nodes are dropped as soon
+        as they are parsed, unless the tree is kept and handed to Descriptions so that it doesn't
+        have to parse the file again. The top level identifiers are recorded next to the XML file
+        so that Descriptions only loads the trees it needs.
+        :return: True if the file is well formed
+        """
         try:
-            etree.parse(xml_to_check)
-            print(xml_to_check)
+            root = None
+            depth = 0
+            idents = []
+            for event, elem in ET.iterparse(xml_to_check, events=("start", "end")):
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1:
+                    if elem.get("ident") is not None:
+                        idents.append(elem.get("ident"))
+                    if not keep:
+                        root.clear()
+            if root is None:
+                raise ET.ParseError("no element found")
+            with open(idents_file(xml_to_check), "w") as fd:
+                json.dump(idents, fd)
+            if keep:
+                self.sysobj.xml_trees[basename(xml_to_check)] = ET.ElementTree(root)
             return True
         except Exception as e:
             self.logger.error(e)
             self.logger.warning( xml_to_check + ": Corrupted XML file" )
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,85 @@
+# Module : Cache.py
+# Description : Content hashing and on-disk manifests used to skip work that is already up to date
+import hashlib
+import json
+import os
+import threading
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_file(path) -> str:
+    """
+    Hash the contents of a file
+    :return: hex digest, or None if the file can't be read
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as fd:
+            for chunk in iter(lambda: fd.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    except IOError:
+        return None
+    return digest.hexdigest()
+
+
+def hash_strings(*parts) -> str:
+    """
+    Hash a sequence of strings, keeping the boundaries between them
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8", "surrogateescape"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FileHasher(object):
+    """Memoizes file hashes for the duration of a run, headers are shared by many translation units"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, path):
+        with self.lock:
+            if path in self.hashes:
+                return self.hashes[path]
+        file_hash = hash_file(path)
+        with self.lock:
+            self.hashes[path] = file_hash
+        return file_hash
+
+
+class Manifest(object):
+    """JSON manifest mapping an output file to the key it was built from"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, "r") as fd:
+                self.entries = json.load(fd)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, name):
+        with self.lock:
+            return self.entries.get(name)
+
+    def set(self, name, entry):
+        with self.lock:
+            self.entries[name] = entry
+
+    def discard(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "w") as fd:
+                json.dump(self.entries, fd)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,80 @@
+# Module : Decisions.py
+# Description : Answers to the interactive prompts, from the user, a batch policy or a recorded answers file
+from core.logger import get_logger
+
+import json
+import os
+
+POLICIES = ("first", "int64", "reject")
+
+
+class Decisions(object):
+    """
+    Every question the pipeline would ask on stdin goes through ask().
+    A recorded answer is replayed first, otherwise the batch policy answers it,
+    or the user is prompted when no policy is set. Every answer is recorded to the answers file.
+    """
+
+    def __init__(self, sysobj):
+        self.sysobj = sysobj
+        self.policy = sysobj.batch_policy
+        self.answers_file = sysobj.answers_file
+        self.logger = get_logger("Decisions", sysobj.log_level)
+        self.answers = {}
+        if self.answers_file is not None and os.path.isfile(self.answers_file):
+            try:
+                with open(self.answers_file, "r") as fd:
+                    self.answers = json.load(fd)
+                self.logger.info("[+] Loaded %d recorded answers from %s", len(self.answers), self.answers_file)
+            except (IOError, ValueError):
+                self.logger.warning("[!] Unable to read the answers file " + self.answers_file)
+
+    @property
+    def interactive(self) -> bool:
+        return self.policy is None
+
+    @property
+    def scope(self) -> str:
+        """
+        Prefix of the keys, answers recorded for one target are never replayed for another
+        :return: name of the target
+        """
+        return os.path.basename(os.path.normpath(self.sysobj.target))
+
+    def ask(self, key, prompt, choices=None, defaults=None, aliases=None):
+        """
+        Answer a question
+        :param key: stable identifier of the question within the target, used to replay the answer
+        :param prompt: text shown to the user
+        :param choices: valid answers, or None to accept any answer
+        :param defaults: answer of each batch policy, a None answer means the question is skipped
+        :param aliases: other inputs accepted from the user, mapped to the answer they stand for
+        :return: the answer, a recorded answer that is no longer a valid choice is treated as unanswered
+        """
+        key = self.scope + ":" + key
+        if key in self.answers and (choices is None or self.answers[key] in choices):
+            answer = self.answers[key]
+            self.logger.debug("[*] Replaying answer for " + key + ": " + str(answer))
+            return answer
+
+        if self.interactive:
+            answer = input(prompt)
+            answer = (aliases or {}).get(answer, answer)
+            while choices is not None and answer not in choices:
+                answer = input(prompt)
+                answer = (aliases or {}).get(answer, answer)
+        else:
+            answer = (defaults or {}).get(self.policy)
+            self.logger.info("[*] Answered " + key + " with the " + self.policy + " policy: " + str(answer))
+        self.record(key, answer)
+        return answer
+
+    def record(self, key, answer):
+        self.answers[key] = answer
+        if self.answers_file is None:
+            return
+        # written after every answer, so an interrupted run can be replayed up to where it stopped
+        tmp_path = self.answers_file + ".tmp"
+        with open(tmp_path, "w") as fd:
+            json.dump(self.answers, fd, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.answers_file)
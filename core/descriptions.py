@@ -5,9 +5,16 @@ import sys
 
 from core.utils import *
 from core.logger import get_logger
+from core.symbols import SymbolIndex
+from core.c2xml import read_idents
+from core.typegraph import TypeGraph
+from core.flags import FlagGroupIndex, FlagNameIndex
+from core.writer import DescriptionWriter, join_sections
+from core.astcache import TranslationUnitCache, COPY_FUNCTIONS, summarize_ioctl_cases
 
 from os.path import join
-from fuzzywuzzy import fuzz, process
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 import xml.etree.ElementTree as ET
 import re
 import os
@@ -57,6 +64,9 @@ type_dict = {
 # 'signed long long','signed long long int','unsigned long long','unsigned long long int',
 # 'float','double','long double','const','struct','union']
 
+# pointers resolved recursively before the pointed to structs and unions are queued
+INLINE_POINTERS = 32
+
 
 class Descriptions(object):
     def __init__(self, sysobj):
@@ -75,6 +85,27 @@ class Descriptions(object):
         self.current_file = None
         self.functions = {}
         self.trees = {}
+        self.symbols = SymbolIndex(self.load_candidate)
+        ast_dir = os.path.join(os.getcwd(), "out/", sysobj.os, "astcache/") if sysobj.use_cache else None
+        self.tu_cache = TranslationUnitCache(sysobj.tu_cache_mb << 20, self.logger, ast_dir,
+                                             sysobj.ast_cache_mb << 20)
+        self.preprocessed_files = None
+        self.ioctl_summaries = {}
+        self.flag_groups = {}
+        self.flag_names = {}
+        # resolved descriptions, keyed by (file, node id, default name, pointer direction)
+        self.type_cache = {}
+        self.type_cache_hits = 0
+        self.type_cache_misses = 0
+        # structs and unions behind deeply nested pointers are built from a worklist, not recursively
+        self.max_type_depth = sysobj.max_type_depth
+        self.type_worklist = deque()
+        self.types_queued = set()
+        self.types_in_progress = set()
+        self.type_depth = 0
+        self.pointer_nesting = 0
+        self.types_truncated = False
+        self.resolving_types = False
         if self.sysobj.input_type == "ioctl":
             self.ioctls = sysobj.ioctls
             self.flag_descriptions = sysobj.macro_details
@@ -87,18 +118,15 @@ class Descriptions(object):
         :return: root
         """
 
-        try:
-            for tree in self.trees.keys():
-                root = tree.getroot()
-                for child in root:
-                    if child.get("ident") == ident_name:
-                        self.logger.debug("[*] Found Root ")
-                        self.current_root = root
-                        self.current_file = self.trees[tree].split(".")[0]
-                        return root
-        except Exception as e:
-            self.logger.error(e)
+        symbol = self.symbols.lookup(ident_name)
+        if symbol is None:
             self.logger.warning('[*] Unable to find root')
+            return None
+        self.logger.debug("[*] Found Root ")
+        xml_file, root = symbol
+        self.current_root = root
+        self.current_file = xml_file.split(".")[0]
+        return root
 
     def resolve_id(self, root, find_id=None):
         """
@@ -106,26 +134,18 @@ class Descriptions(object):
         :return: node
         """
 
-        try:
-            # adding this case because build_function calls resolve_id without find_id argument
-            if find_id is None:
-                self.logger.warning("[!] find_id is NULL, hence returning None")
-                return None
-            for element in root:
-                if element.get("id") == find_id:
-                    return element
-
-            for element in root:    # try deeper nodes
-                for child in element:
-                    if child.get("id") == find_id:
-                        return child
-        except Exception as e:
-            self.logger.error(e)
+        # adding this case because build_function calls resolve_id without find_id argument
+        if find_id is None:
+            self.logger.warning("[!] find_id is NULL, hence returning None")
+            return None
+        if root is None:
             self.logger.warning("[!] Issue in resolving: %s", find_id)
+            return None
+        return self.symbols.root_index(root).ids.get(find_id)
 
     def get_id(self, root, find_ident):
         """
-        Find node having ident value same as find_ident
+        Find node having ident value same as find_ident, falling back to the other trees
         :return: 
         """
 
@@ -133,21 +153,17 @@ class Descriptions(object):
             if root is None:
                 self.logger.warning("[!] get_id() -> Root is NULL, hence returning NULL")
                 return None
-            for element in root:
-                # if element is found in the tree call get_type
-                # function, to find the type of argument for descriptions
-                if element.get("ident") == find_ident:
-                    self.logger.debug("- Generating description for " + find_ident)
-                    generatedType = self.get_type(element), element
-                    # print the generatedType as a str
-                    print(str(generatedType))
-                    return generatedType
-                for child in element:
-                    if child.get("ident") == find_ident:
-                        self.logger.debug("- Generating description for child" + find_ident)
-                        return self.get_type(child), child
-            self.logger.debug("TO-DO: Find again")
-            self.get_id(self.current_root, find_ident)
+            element = self.symbols.root_index(root).idents.get(find_ident)
+            if element is None:
+                # not in this tree, look for a tree defining it at its top level
+                if self.get_root(find_ident) is None:
+                    self.logger.warning("[!] Issue in resolving: %s", find_ident)
+                    return None
+                element = self.symbols.root_index(self.current_root).top_idents[find_ident]
+            # if element is found in the tree call get_type
+            # function, to find the type of argument for descriptions
+            self.logger.debug("- Generating description for " + find_ident)
+            return self.get_type(element), element
         except Exception as e:
             self.logger.error(e)
             exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -157,11 +173,122 @@ class Descriptions(object):
 
     def get_type(self, child, default_name=None):
         """
-        Fetch type of an element
+        Fetch type of an element, every node is resolved once per default name and pointer direction
         :return:
         """
         if default_name == "default_name":
             return "int64"
+        key = self.type_key(child, default_name)
+        if key is not None:
+            desc = self.type_cache.get(key)
+            if desc is not None:
+                self.type_cache_hits += 1
+                return desc
+            self.type_cache_misses += 1
+        truncated, self.types_truncated = self.types_truncated, False
+        if self.resolving_types:
+            desc = self.resolve_type(child, default_name)
+        else:
+            # outermost call, the queued structs and unions are built before returning
+            self.resolving_types = True
+            try:
+                desc = self.resolve_type(child, default_name)
+                self.drain_types()
+            finally:
+                self.resolving_types = False
+        # a description cut by the depth budget may resolve further from a shallower pointer
+        if key is not None and desc is not None and not self.types_truncated:
+            self.type_cache[key] = desc
+        self.types_truncated = self.types_truncated or truncated
+        return desc
+
+    def type_key(self, child, default_name):
+        """
+        Key of a node in the type cache. Pointer directions are part of it for ioctls, where the
+        direction of the command is used, syscalls ask for the direction of each pointer node.
+        :return: tuple, or None if the node can't be cached
+        """
+        if child is None or child.get("id") is None:
+            return None
+        ptr_dir = self.ptr_dir if self.sysobj.input_type == "ioctl" else None
+        return self.current_file, child.get("id"), default_name, ptr_dir
+
+    def invalidate_types(self):
+        """Drop the resolved descriptions once flags are inserted in the structs, unions or gflags"""
+        if self.type_cache:
+            self.logger.debug("[*] Invalidating %d resolved types", len(self.type_cache))
+            self.type_cache.clear()
+
+    def drain_types(self):
+        """
+        Build the structs and unions queued by pointee_type, in the order they were queued. Each one is
+        built in the tree it was referenced from, with the pointer direction and depth of that time.
+        """
+        saved = self.current_root, self.current_file, self.ptr_dir, self.type_depth, self.pointer_nesting
+        while self.type_worklist:
+            node, name, default_name, depth, root, file, ptr_dir = self.type_worklist.popleft()
+            self.types_queued.discard(name)
+            self.current_root, self.current_file, self.ptr_dir, self.type_depth = root, file, ptr_dir, depth
+            self.pointer_nesting = 0
+            self.logger.debug("[*] Building queued type " + name)
+            self.get_type(node, default_name)
+        self.current_root, self.current_file, self.ptr_dir, self.type_depth, self.pointer_nesting = saved
+
+    def pointee_type(self, node, default_name=None):
+        """
+        Description of the target of a pointer. A struct or union that isn't built yet is built right
+        away, unless INLINE_POINTERS pointers are already being resolved on the stack: it is then
+        queued and referenced by name. Past max_type_depth pointers from the argument it isn't followed.
+        :return: description, or None past the depth budget
+        """
+        if node is None or node.get("type") not in ("struct", "union"):
+            return self.get_type(node, default_name)
+        name = node.get("ident") if node.get("ident") is not None else default_name
+        if name is None or name in self.structs_defs or name in self.union_defs or name in self.types_in_progress:
+            return self.get_type(node, default_name)
+        if node.get("type") == "union" and (node.get("start-line") is None or node.get("end-line") is None):
+            # unions without a definition have no description
+            return self.get_type(node, default_name)
+        if name in self.types_queued:
+            return str(name)
+        if self.max_type_depth is not None and self.type_depth >= self.max_type_depth:
+            self.logger.warning("[!] Type depth budget reached, not following the pointer to " + name)
+            self.types_truncated = True
+            return None
+        if self.pointer_nesting < INLINE_POINTERS:
+            self.type_depth += 1
+            self.pointer_nesting += 1
+            try:
+                return self.get_type(node, default_name)
+            finally:
+                self.type_depth -= 1
+                self.pointer_nesting -= 1
+        self.types_queued.add(name)
+        self.type_worklist.append((node, name, default_name, self.type_depth + 1, self.current_root,
+                                   self.current_file, self.ptr_dir))
+        return str(name)
+
+    def base_node(self, child):
+        """
+        Follow base-type links, of typedefs for instance, up to the node that describes the type
+        :return: node, or None if the chain is broken or cyclic
+        """
+        visited = set()
+        node = child
+        while node is not None and node.get("type") not in ("struct", "union", "function", "pointer", "array", "enum") \
+                and "base-type-builtin" not in node.keys():
+            if node.get("id") in visited:
+                self.logger.warning("[!] Cyclic base-type chain at " + str(node.get("id")))
+                return None
+            visited.add(node.get("id"))
+            node = self.resolve_id(self.current_root, node.get("base-type"))
+        return node
+
+    def resolve_type(self, child, default_name=None):
+        """
+        Build the description of an element, see get_type
+        :return:
+        """
         try:
             # for structures: need to define each element present in struct (build_struct)
             if child.get("type") == "struct":
@@ -211,8 +338,7 @@ class Descriptions(object):
                 # custom type
             else:
                 self.logger.debug("TO-DO: base-type")
-                root = self.resolve_id(self.current_root, child.get("base-type"))
-                return self.get_type(root, default_name=default_name)
+                return self.get_type(self.base_node(child), default_name=default_name)
         except Exception as e:
             self.logger.error(e)
             exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -232,24 +358,22 @@ class Descriptions(object):
                 flg_name = name + "_" + strct_name + "_flag"
             flags = []
             if self.sysobj.input_type == "ioctl":
-                for i in range(len(self.flag_descriptions[file_name])):
-                    flag_tups = self.flag_descriptions[file_name][i]
-                    if (int(flag_tups[1]) > strt_line - 1 and int(flag_tups[2]) < end_line - 1):
-                        self.logger.debug("[*] Found instruct flags")
-                        del self.flag_descriptions[file_name][i]
-                        flags = flag_tups[0]
-                        break
+                flag_groups = self.flag_index(file_name)
+                index = flag_groups.within(strt_line, end_line - 1)
+                if index is not None:
+                    self.logger.debug("[*] Found instruct flags")
+                    flag_groups.consume(index)
+                    flags = flag_groups.macros(index)
             else:
-                cnt = 0
                 total = int(end_line) - strt_line - 1
-                for child in self.current_root:
-                    if int(child.get("start-line")) in range(strt_line + 1, end_line):
-                        cnt += 1
-                        flags.append(child.get("ident"))
-                    if cnt == total:
-                        return
+                children = self.symbols.root_index(self.current_root).span(strt_line + 1, end_line)
+                if len(children) >= total:
+                    # every line in between is taken by a node
+                    return
+                flags = [child.get("ident") for child in children]
             if len(flags) > 0 and None not in flags:
                 self.gflags[flg_name] = ", ".join(flags)
+                self.invalidate_types()
                 ret_str = "flags[" + str(flg_name) + ", " + str(flg_type) + "]"
             else:
                 ret_str = None
@@ -258,26 +382,44 @@ class Descriptions(object):
             self.logger.error(e)
             self.logger.warning("[!] Error in grabbing flags")
 
+    def flag_index(self, file_name) -> FlagGroupIndex:
+        """
+        Line index of the flag groups of a preprocessed file, built on first use
+        :return: FlagGroupIndex
+        """
+        flag_groups = self.flag_groups.get(file_name)
+        if flag_groups is None:
+            flag_groups = FlagGroupIndex(self.flag_descriptions.get(file_name, []))
+            self.flag_groups[file_name] = flag_groups
+        return flag_groups
+
+    def flag_name_index(self, file_name) -> FlagNameIndex:
+        """
+        Trigram index of the names of the flag groups of a preprocessed file, built on first use
+        :return: FlagNameIndex
+        """
+        flag_names = self.flag_names.get(file_name)
+        if flag_names is None:
+            flag_names = FlagNameIndex(self.flag_index(file_name))
+            self.flag_names[file_name] = flag_names
+        return flag_names
+
     def possible_flags(self, strct_name):
         """function to find possible categories of leftover flags
         """
         self.logger.debug("[*] Finding possible flags for " + strct_name)
-        small_flag = []
         visited = []
         file = self.current_file + ".i"
-        for i in range(len(self.flag_descriptions[file])):
-            flags = self.flag_descriptions[file][i][0]
-            small_flag.extend([i.lower() for i in flags])
-        matches = [choice for (choice, score) in process.extract(strct_name, small_flag, scorer=fuzz.partial_ratio) if
-                   (score >= 50)]
+        flag_groups = self.flag_index(file)
+        matches = self.flag_name_index(file).rank(strct_name)
         self.logger.info("[+] Possible flags groups for " + strct_name + ": ")
         for match in matches:
             find_str = match.upper()
-            for i in range(len(self.flag_descriptions[file])):
-                if (find_str in self.flag_descriptions[file][i][0]):
-                    if (self.flag_descriptions[file][i][0] not in visited):
-                        visited.append(self.flag_descriptions[file][i][0])
-                        self.logger.info("[XX]" + str(self.flag_descriptions[file][i][0]))
+            for _, flags in flag_groups.live():
+                if (find_str in flags):
+                    if (flags not in visited):
+                        visited.append(flags)
+                        self.logger.info("[XX]" + str(flags))
                     break
         self.logger.info("-------------------------")
 
@@ -286,50 +428,25 @@ class Descriptions(object):
         try:
             self.logger.debug("[*] Finding flags in vicinity of " + name)
             file_name = self.current_file + ".i"
-            last_tup = len(self.flag_descriptions[file_name])
-            # for flags after the struct
-            max_line_no = self.flag_descriptions[file_name][0][2]
-            min_line_no = self.flag_descriptions[file_name][last_tup - 1][1]
-            index = None
-            for i in range(last_tup - 1, 0, -1):
-                flags_tup = self.flag_descriptions[file_name][i]
-                # find flags after the enf of struct, if start of flag tuple is < end of struct
-                if flags_tup[1] < end:
-                    if index == None:
-                        break
-                    min_tup = self.flag_descriptions[file_name][index]
-                    print("\033[31;1m[ ** ] Found flags in vicinity\033[m of " + name + ": " + str(min_tup[0]))
-                    if (self.append_flag()):
-                        if (self.add_flag(min_tup[0], name)):
-                            del self.flag_descriptions[file_name][index]
-                    break
-                elif (min_line_no > flags_tup[1]):
-                    min_line_no = flags_tup[1]
-                    index = i
-            index = None
-            for i in range(last_tup):
-                flags_tup = self.flag_descriptions[file_name][i]
-                # find flags present before start of struct, if end of flag tuple is > start of struct
-                if flags_tup[2] > start:
-                    if index == None:
-                        break
-                    max_tup = self.flag_descriptions[file_name][index]
-                    print("\033[31;1m[ ** ] Found flags in vicinity\033[m of " + name + ": " + str(max_tup[0]))
-                    if (self.append_flag()):
-                        if (self.add_flag(max_tup[0], name)):
-                            del self.flag_descriptions[file_name][index]
-                    break
-                elif (max_line_no < flags_tup[2]):
-                    max_line_no = flags_tup[2]
-                    index = i
+            flag_groups = self.flag_index(file_name)
+            # nearest flags after the end of the struct, then nearest flags before its start
+            for index in (flag_groups.after(end), flag_groups.before(start)):
+                if index is None:
+                    continue
+                flags = flag_groups.macros(index)
+                print("\033[31;1m[ ** ] Found flags in vicinity\033[m of " + name + ": " + str(flags))
+                if (self.append_flag(flags, name)):
+                    if (self.add_flag(flags, name)):
+                        flag_groups.consume(index)
             return
         except Exception as e:
             self.logger.error(e)
             self.logger.warning("[!] Error in finding flags present near struct " + name)
 
-    def append_flag(self):
+    def append_flag(self, flags, strct_name):
         try:
-            if (input("Add the predicted flags? (y/n): ") == "y"):
+            if (self.sysobj.decisions.ask("flags:" + strct_name + ":" + ",".join(flags), "Add the predicted flags? (y/n): ",
+                                          None, {"first": "y", "int64": "n", "reject": "n"}) == "y"):
                 return True
             return False
         except Exception as e:
@@ -339,9 +456,21 @@ class Descriptions(object):
     def add_flag(self, flags, strct_name, element=None):
         try:
             if element is None:
-                element = input("Enter the element name from " + strct_name + " to modify: ")
+                if strct_name in self.structs_defs.keys():
+                    elements = list(self.structs_defs[strct_name][1].keys())
+                elif strct_name in self.union_defs.keys():
+                    elements = list(self.union_defs[strct_name][1].keys())
+                else:
+                    elements = []
+                element = self.sysobj.decisions.ask(
+                    "flag_element:" + strct_name + ":" + ",".join(flags),
+                    "Enter the element name from " + strct_name + " to modify: ", elements or None,
+                    {"first": elements[0] if elements else None})
+                if element is None:
+                    return False
             flag_name = element + "_" + strct_name + "_flag"
             self.gflags[flag_name] = ", ".join(flags)
+            self.invalidate_types()
             if strct_name in self.structs_defs.keys():
                 flag_type = self.structs_defs[strct_name][1][element]
                 self.structs_defs[strct_name][1][element] = "flags[" + flag_name + ", " + flag_type + "]"
@@ -358,13 +487,9 @@ class Descriptions(object):
 
     def break_enum(self, name, start, end):
         total = (end - start) - 1
-        cnt = 0
-        for child in self.current_root:
-            if int(child.get("start-line")) in range(start + 1, end):
-                cnt += 1
-                self.gflags[name].append(child.get("ident"))
-            if cnt == total:
-                return
+        # the first <total> nodes starting between the lines of the enum, in document order
+        for child in self.symbols.root_index(self.current_root).span(start + 1, end)[:max(total, 0)]:
+            self.gflags[name].append(child.get("ident"))
 
     def build_enums(self, child):
         name = child.get("ident")
@@ -384,7 +509,10 @@ class Descriptions(object):
         try:
             self.logger.debug("[*] Building pointer")
             if self.sysobj.input_type == "syscall":
-                self.ptr_dir = input("Enter pointer direction: ")
+                self.ptr_dir = self.sysobj.decisions.ask(
+                    "ptr:" + os.path.basename(self.current_file) + ":" + str(child.get("id")),
+                    "Enter pointer direction: ", ["in", "out", "inout"],
+                    {"first": "in", "int64": "inout", "reject": "inout"})
             # pointer is a builtin type
             if "base-type-builtin" in child.attrib.keys():
                 base_type = child.get("base-type-builtin")
@@ -397,11 +525,12 @@ class Descriptions(object):
                     ptr_str = "ptr[" + self.ptr_dir + ", " + str(type_dict[child.get("base-type-builtin")]) + "]"
             # pointer is of custom type, call get_type function
             else:
+                target = self.base_node(self.resolve_id(self.current_root, child.get("base-type")))
                 if default_name is not None and child.get('ident') is None:
                     self.logger.debug("- Generating description for " + default_name)
-                    x = self.get_type(self.resolve_id(self.current_root, child.get("base-type")), default_name)
+                    x = self.pointee_type(target, default_name)
                 else:
-                    x = self.get_type(self.resolve_id(self.current_root, child.get("base-type")))
+                    x = self.pointee_type(target)
                 if x is None:
                     ptr_str = "ptr[" + self.ptr_dir + ", " + "int64" + "]"
                 else:
@@ -539,12 +668,18 @@ class Descriptions(object):
         :return: Union identifier
         """
         # regex to check if name of element contains 'len' keyword
+        building = False
         try:
             len_regx = re.compile("(.+)len")
             name = child.get("ident")
             if name is None:
                 name = default_name
+            if name in self.types_in_progress:
+                # the union contains itself through its members, refer to it by name
+                return str(name)
             if name not in self.union_defs.keys():
+                self.types_in_progress.add(name)
+                building = True
                 self.logger.warning("[*] Building union: " + name)
                 elements = {}
                 prev_elem_name = "nill"
@@ -627,6 +762,9 @@ class Descriptions(object):
                 self.structs_defs[name] = None
                 print("defaulting to long")
                 return "long"
+        finally:
+            if building:
+                self.types_in_progress.discard(name)
 
     def checkname(self, name):
         return "res" if name == "resource" else name
@@ -639,32 +777,59 @@ class Descriptions(object):
 
 
     def pretty_func(self):
-        func_str = ""
+        return "".join(self.iter_func())
+
+    def iter_func(self):
+        """
+        Descriptions of the functions, one chunk per function
+        :return: generator of str
+        """
         for func in self.functions.keys():
             if func in self.func_consts:
                 const_var = self.func_consts[func][0]
-                func_str += func + "("
+                func_str = func + "("
                 func_str += ", ".join([self.checkname(name) + " " + self.checkdesc(desc,name,const_var,func) for name, desc in zip(self.functions[func][0].keys(), self.functions[func][0].values())]) + ") "
                 self.gflags[func+'_'+const_var+'_flag'] = self.func_consts[func][1]
                 if self.functions[func][1] is not None:
                     func_str += self.functions[func][0]
                 func_str+="\n"
             else:
-                func_str += func + "("
+                func_str = func + "("
                 func_str += ", ".join([self.checkname(name) + " " + desc for name, desc in zip(self.functions[func][0].keys(), self.functions[func][0].values())]) + ") "
                 if self.functions[func][1] is not None:
                     func_str += self.functions[func][0]
                 func_str+="\n"
-        return func_str
+            yield func_str
+
+    def register_func_flags(self):
+        """
+        Add the flags of the constants switched on by the functions to gflags, which iter_func does
+        as it goes, for the includes that have to be written before the functions
+        """
+        for func in self.functions.keys():
+            if func in self.func_consts:
+                const_var = self.func_consts[func][0]
+                self.gflags[func + '_' + const_var + '_flag'] = self.func_consts[func][1]
 
     def pretty_structs_unions(self):
         """
         Generates descriptions of structs and unions for syzkaller
         :return:
         """
+        return "".join(self.iter_structs_unions())
+
+    def iter_structs_unions(self):
+        """
+        Descriptions of structs and unions, one chunk per definition, yielded once the flags found
+        around it were added
+        :return: generator of str
+        """
 
         self.logger.debug("[*] Pretty printing structs and unions ")
-        pretty = ""
+        if self.sysobj.input_type == "ioctl" and (self.structs_defs or self.union_defs) \
+                and self.current_file is not None:
+            # candidates of every struct and union are ordered in one pass over the macro names
+            self.flag_name_index(self.current_file + ".i").prepare(list(self.structs_defs) + list(self.union_defs))
         for key in self.structs_defs:
             element_str = ""
             if self.structs_defs[key] is None or len(self.structs_defs[key]) < 2:
@@ -681,12 +846,12 @@ class Descriptions(object):
             #get flags in vicinity of structs for ioctls
             if self.sysobj.input_type == "ioctl":
                 self.find_flags(key, element_names, strct_strt, strct_end)
-                # predictions fopossible_flagsr uncategorised flags
+                # predictions for uncategorised flags
                 self.possible_flags(key)
             for element in self.structs_defs[key][1]:
                 element_str += "\t" + element + "\t" + self.structs_defs[key][1][element] + "\n"
             elements = " {\n" + element_str + "}\n"
-            pretty += (str(key) + str(elements) + "\n")
+            yield str(key) + str(elements) + "\n"
         for key in self.union_defs:
             element_str = ""
             node = self.union_defs[key][0]
@@ -705,8 +870,7 @@ class Descriptions(object):
             for element in self.union_defs[key][1]:
                 element_str += "\t" + element + "\t" + self.union_defs[key][1][element] + "\n"
             elements = " [\n" + element_str + "]\n"
-            pretty += (str(key) + str(elements) + "\n")
-        return pretty
+            yield str(key) + str(elements) + "\n"
 
     def pretty_ioctl(self, fd):
         """
@@ -715,59 +879,88 @@ class Descriptions(object):
         """
 
         try:
-            self.logger.debug("[*] Pretty printing ioctl descriptions")
-            descriptions = ""
-            if self.arguments is not None:
-                for key in self.arguments:
-                    desc_str = "ioctl$" + key + "("
-                    fd_ = "fd " + fd.replace("-", "_")
-                    cmd = "cmd const[" + key + "]"
-                    arg = ""
-                    if self.arguments[key] is not None and str(self.arguments[key]) != "":
-                        arg = "arg " + str(self.arguments[key])
-                        desc_str += ", ".join([fd_, cmd, arg])
-                    else:
-                        desc_str += ", ".join([fd_, cmd])
-                    desc_str += ")\n"
-                    descriptions += desc_str
-            return descriptions
+            return "".join(self.iter_ioctl(fd))
         except Exception as e:
             self.logger.error(e)
             self.logger.warning("[!] Error in parsing ioctl command descriptions")
 
-    def pretty_syscall(self):
-        func_str = self.pretty_func()
-        struct_union_str = self.pretty_structs_unions()
-        flag_str = ""
-        includes = ""
+    def iter_ioctl(self, fd):
+        """
+        Descriptions of the ioctl calls, one chunk per command
+        :return: generator of str
+        """
+        self.logger.debug("[*] Pretty printing ioctl descriptions")
+        if self.arguments is not None:
+            for key in self.arguments:
+                desc_str = "ioctl$" + key + "("
+                fd_ = "fd " + fd.replace("-", "_")
+                cmd = "cmd const[" + key + "]"
+                arg = ""
+                if self.arguments[key] is not None and str(self.arguments[key]) != "":
+                    arg = "arg " + str(self.arguments[key])
+                    desc_str += ", ".join([fd_, cmd, arg])
+                else:
+                    desc_str += ", ".join([fd_, cmd])
+                desc_str += ")\n"
+                yield desc_str
+
+    def iter_syscall_flags(self):
         for flg_name in self.gflags:
             if len(self.gflags[flg_name]) == 1: # debug this corner case. Why no header?
-                flag_str += flg_name + " = " + ','.join(self.gflags[flg_name]) + "\n"
+                yield flg_name + " = " + ','.join(self.gflags[flg_name]) + "\n"
             else:
-                flag_str += flg_name + " = " + ','.join(self.gflags[flg_name][0]) + "\n"
-                if self.gflags[flg_name][1] != "":
-                    includes += '#include <' + self.gflags[flg_name][1] + '>\n'
+                yield flg_name + " = " + ','.join(self.gflags[flg_name][0]) + "\n"
+
+    def syscall_chunks(self):
+        """
+        Chunks of the syscall description file, in order
+        :return: generator of str
+        """
+        # the flags of the functions are needed for the includes, written first
+        self.register_func_flags()
+        includes = ""
+        for flg_name in self.gflags:
+            if len(self.gflags[flg_name]) != 1 and self.gflags[flg_name][1] != "":
+                includes += '#include <' + self.gflags[flg_name][1] + '>\n'
+        return join_sections([[includes], self.iter_func(), self.iter_structs_unions(), self.iter_syscall_flags()])
+
+    def pretty_syscall(self, in_memory=False):
+        """
+        Generates the syscall description file, streaming it as it is generated
+        :return: Path of output file, or an iterator of its chunks with <in_memory>
+        """
+        if in_memory:
+            return self.syscall_chunks()
         output_file_path = os.path.join(os.getcwd(),"out", self.sysobj.os, "syscalls.txt")
-        output_file = open( output_file_path, "w")
-        output_file.write("\n".join([includes, func_str, struct_union_str, flag_str]))
-        output_file.close()
+        with DescriptionWriter(output_file_path) as writer:
+            writer.write(self.syscall_chunks())
         return output_file_path
 
-    def make_file(self):
+    def iter_ioctl_flags(self):
+        for flg_name in self.gflags:
+            # check if os is linux
+            if self.sysobj.os == "linux":
+                yield flg_name + " = " + str(self.gflags[flg_name]) + "\n"
+            else:
+                yield flg_name + " = " + ", ".join(self.gflags[flg_name]) + "\n"
+
+    def ioctl_chunks(self):
         """
-        Generates a device specific file with descriptions of ioctl calls
-        :return: Path of output file
+        Chunks of the device description file, in order
+        :return: generator of str
         """
-
-        self.logger.debug("[*] Generating description file")
         includes = ""
         if self.sysobj.os_type == "linux":
             include_path = "linux/" + os.path.basename(self.sysobj.target) + "/"
         else:
             include_path = "dev/" + os.path.basename(self.sysobj.target) + "/"
-        flags_defn = ""
+        outside_headers = getattr(self.sysobj, "outside_headers", ())
         for h_file in set(self.header_files):
-            includes += "include <" + include_path + h_file + ">\n"
+            if h_file in outside_headers:
+                # already spelled from an include directory of the kernel
+                includes += "include <" + h_file + ">\n"
+            else:
+                includes += "include <" + include_path + h_file + ">\n"
 
         if self.sysobj.os_type == "linux": # extra includes for linux
             includes += "include <uapi/" + include_path + h_file + ">\n"
@@ -777,25 +970,62 @@ class Descriptions(object):
         open_desc = "openat$" + dev_name.lower().replace("-", "_")
         open_desc += "(fd const[AT_FDCWD], file ptr[in, string[\"/dev/" + dev_name.replace("-", "_") + "\"]], "
         open_desc += "flags flags[open_flags], mode const[0]) fd_" + dev_name.replace("-", "_") + "\n"
-        func_descriptions = str(self.pretty_ioctl(fd_str))
-        struct_descriptions = str(self.pretty_structs_unions())
-        for flg_name in self.gflags:
-            # check if os is linux
-            if self.sysobj.os == "linux":
-                flags_defn += flg_name + " = " + str(self.gflags[flg_name]) + "\n"
+        yield "# Copyright 2018 syzkaller project authors. All rights reserved.\n# Use of this source code is governed by Apache 2 LICENSE that can be found in the LICENSE file.\n# Autogenerated by sys2syz\n\n"
+        for chunk in join_sections([[includes], [rsrc], [open_desc], self.iter_ioctl(fd_str), self.iter_func(),
+                                    self.iter_structs_unions(), self.iter_ioctl_flags()]):
+            yield chunk
+
+    def make_file(self, in_memory=False):
+        """
+        Generates a device specific file with descriptions of ioctl calls, streaming it as it is generated
+        :return: Path of output file, or an iterator of its chunks with <in_memory>
+        """
+
+        self.logger.debug("[*] Generating description file")
+        if in_memory:
+            return self.ioctl_chunks()
+        dev_name = self.target.split("/")[-1]
+        output_file_path = os.path.join(os.getcwd(), "out", self.sysobj.os, "dev_" + dev_name + ".txt")
+        with DescriptionWriter(output_file_path) as writer:
+            writer.write(self.ioctl_chunks())
+        return output_file_path
+
+    def wants_xml(self, xml_file):
+        """
+        Checks if the descriptions will be generated from an XML file, so its parsed tree is worth keeping
+        :return: True if the file will be parsed
+        """
+        if self.sysobj.input_type == "ioctl" or self.sysobj.typegraph:
+            # ioctl runs load the trees they need lazily, see load_candidate,
+            # type graphs are converted from the XML file
+            return False
+        target_files = set(define[0].split('/')[-1].split('.')[0] for define in self.sysobj.defines_dict.values())
+        return xml_file[:-4] in target_files
+
+    def load_tree(self, xml_file):
+        """
+        Returns the tree of an XML file, reusing the one built while C2xml verified it.
+        With --typegraph the compact TypeGraph of the file is returned instead.
+        :return: ElementTree or TypeGraph
+        """
+        tree = self.sysobj.xml_trees.get(xml_file)
+        if tree is None:
+            if self.sysobj.typegraph:
+                tree = TypeGraph.for_xml(join(self.xml_dir, xml_file))
             else:
-                flags_defn += flg_name + " = " + ", ".join(self.gflags[flg_name]) + "\n"
-        if func_descriptions is not None:
-            desc_buf = "# Copyright 2018 syzkaller project authors. All rights reserved.\n# Use of this source code is governed by Apache 2 LICENSE that can be found in the LICENSE file.\n# Autogenerated by sys2syz\n\n"
-            desc_buf += "\n".join(
-                [includes, rsrc, open_desc, func_descriptions, self.pretty_func(), struct_descriptions, flags_defn])
-            output_file_path = os.path.join(os.getcwd(), "out", self.sysobj.os, "dev_" + dev_name + ".txt")
-            output_file = open(output_file_path, "w")
-            output_file.write(desc_buf)
-            output_file.close()
-            return output_file_path
-        else:
-            return None
+                tree = ET.parse(join(self.xml_dir, xml_file))
+            self.sysobj.xml_trees[xml_file] = tree
+        return tree
+
+    def load_candidate(self, xml_file):
+        """
+        Loads a candidate tree the first time one of its identifiers is needed
+        :return: root
+        """
+        self.logger.debug("[*] Loading " + xml_file)
+        tree = self.load_tree(xml_file)
+        self.trees[tree] = xml_file
+        return tree.getroot()
 
     def isFileAGoodCandidate(self, Intertingfile):
         """
@@ -803,8 +1033,9 @@ class Descriptions(object):
         :param file: File to check
         :return: True if file is a good candidate, False otherwise
         """
-        # remove .xml extension and append .c extension
-        Intertingfile = Intertingfile[:-4] + ".c"
+        # remove .xml extension and append .c extension, unless the preprocessed file was renamed
+        source_names = self.sysobj.bear.source_names if hasattr(self.sysobj, "bear") else {}
+        Intertingfile = source_names.get(Intertingfile[:-4], Intertingfile[:-4] + ".c")
         # check if file exists
         try:
             for root, dirs, files in os.walk(self.target):
@@ -818,30 +1049,64 @@ class Descriptions(object):
                             for line in lines:
                                 if "#include" in line:
                                     for ioctl_header in self.sysobj.header_files:
-                                        if ioctl_header in line:
+                                        if os.path.basename(ioctl_header) in line:
                                             return True
         except IOError:
             self.logger.error("Unable to read the file '%s'", file)
             return False
 
+    def list_preprocessed_files(self, PreprocessedFileDir) -> list:
+        # list the preprocessed files once, their translation units are cached across ioctls
+        if self.preprocessed_files is None:
+            self.preprocessed_files = []
+            for root, dirs, files in os.walk(PreprocessedFileDir):
+                # fetch all the files ending with .i
+                for file in files:
+                    if file.endswith(".i") and not file.startswith("."):
+                        self.preprocessed_files.append(file)
+        return self.preprocessed_files
+
+    def summarize_ioctl_cases(self, constants, PreprocessedFileDir):
+        """
+        Analyse the case labels handling the constants in every preprocessed file, one file per worker
+        process. The per file summaries are merged in file order, the first file handling a constant wins.
+        The constants no file resolved are recorded with an empty definition, they aren't searched again.
+        """
+        files = [os.path.join(PreprocessedFileDir, file) for file in self.list_preprocessed_files(PreprocessedFileDir)]
+        constants = sorted(set(constants))
+        if not files or not constants:
+            return
+        jobs = min(self.sysobj.jobs, len(files))
+        self.logger.info("[*] Analysing %d translation units with %d processes", len(files), jobs)
+        tu_cache = self.tu_cache
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = pool.map(summarize_ioctl_cases, files, [constants] * len(files),
+                               [tu_cache.ast_dir] * len(files), [tu_cache.ast_max_bytes] * len(files))
+            for file, summaries in zip(files, results):
+                for constant, definition in summaries.items():
+                    self.logger.debug("[*] " + os.path.basename(file) + " handles " + constant + ": " + definition)
+                    self.ioctl_summaries.setdefault(constant, definition)
+        unresolved = [constant for constant in constants if constant not in self.ioctl_summaries]
+        if unresolved:
+            self.logger.info("[*] No user copy found for %d ioctls", len(unresolved))
+        for constant in unresolved:
+            self.ioctl_summaries[constant] = ""
+
     def FetchIoctlDescriptionsFromAST(self, IOCTL_CMD, IOCTL_NAME, PreprocessedFileDir):
-        # iterate over all the files in the directory
-        preprocessedFiles = []
-        IoctlDefinitions = None
-        for root, dirs, files in os.walk(PreprocessedFileDir):
-            # fetch all the files ending with .i
-            for file in files:
-                if file.endswith(".i") and not file.startswith("."):
-                    preprocessedFiles.append(file)
-        IoctlDefinitions = None
-        # iterate over all the files
-        for file in preprocessedFiles:
+        if IOCTL_NAME in self.ioctl_summaries:
+            if self.ioctl_summaries[IOCTL_NAME] == "":
+                # analysed by the worker processes without a result
+                return ""
+            self.logger.critical("[*] IOCTL [" + IOCTL_CMD + "] MARSHALL KS_US OBJ: " +
+                                 self.ioctl_summaries[IOCTL_NAME].split(" ")[0])
+            return self.ioctl_summaries[IOCTL_NAME]
+        # iterate over all the files, until one of them has a handler for the ioctl
+        for file in self.list_preprocessed_files(PreprocessedFileDir):
             IoctlDefinitions = self.check_ioctl_switches(IOCTL_CMD=IOCTL_CMD, IOCTL_TRAP=IOCTL_NAME,
                                                          file_=os.path.join(PreprocessedFileDir, file))
-            if IoctlDefinitions is not None:
+            if IoctlDefinitions:
                 return IoctlDefinitions
-        if IoctlDefinitions is None:
-            return ""
+        return ""
 
     def ioctl_run(self):
         """
@@ -851,11 +1116,19 @@ class Descriptions(object):
         self.xml_dir = self.sysobj.out_dir
         # Find the xml file youre interested in
         for xml_file in (os.listdir(self.xml_dir)):
-            if self.isFileAGoodCandidate(xml_file):
-                tree = ET.parse(join(self.xml_dir, xml_file))
-                self.trees[tree] = xml_file
+            if xml_file.endswith(".xml") and self.isFileAGoodCandidate(xml_file):
+                idents = read_idents(join(self.xml_dir, xml_file))
+                if idents is None:
+                    # no identifier list was recorded, the tree has to be loaded to know what it defines
+                    self.symbols.add(self.load_candidate(xml_file), xml_file)
+                else:
+                    self.symbols.declare(xml_file, idents)
         self.flag_descriptions = self.sysobj.macro_details
         self.ioctls = self.sysobj.ioctls
+        # the handlers of the ioctls without an argument type are analysed up front, in parallel
+        pending = [str(command).split(", ")[4] for command in self.ioctls if str(command).split(", ")[3] == "None"]
+        if pending and self.sysobj.jobs > 1:
+            self.summarize_ioctl_cases(pending, os.path.normpath(self.xml_dir + os.sep + os.pardir))
         for command in self.ioctls:
             parsed_command = str(command).split(", ")
             self.ptr_dir, cmd, h_file, argument, IOCTL_TRAP = parsed_command
@@ -923,6 +1196,10 @@ class Descriptions(object):
             # for IO_ ioctls as they don't have any arguments
             else:
                 self.arguments[cmd] = None
+        self.logger.info("[+] %d of %d candidate XML files were never opened",
+                         len(self.symbols.unopened), len(self.symbols.declared))
+        self.logger.info("[+] Reused %d saved translation units", self.tu_cache.ast_hits)
+        self.logger.info("[+] Type cache: %d hits, %d misses", self.type_cache_hits, self.type_cache_misses)
         return True
 
     def find_macro_header(self, macro, linenum):
@@ -1011,8 +1288,7 @@ class Descriptions(object):
         '''
 
         if root is None:
-            index = cindex.Index.create()
-            tu = index.parse(self.current_file)
+            tu = self.tu_cache.get(self.current_file)
             root = tu.cursor
         
         func_cursor = self.find_func_cursor(root, name)
@@ -1117,124 +1393,47 @@ class Descriptions(object):
         '''
 
     def traverse_and_find_trap_case(self, IOCTL_NAME, IOCTL_CMD, tu, _file):
-        preOrderList = list(tu.cursor.walk_preorder())
-        IoctlArg = []
+        # the case labels of the translation unit are indexed in a single traversal, shared by all ioctls
         TargetCursorDecl = None
-        for c in tu.cursor.walk_preorder():
-            if c.location.file is None:
-                pass
-            elif c.location.file.name != _file:
-                pass
-            elif c.kind == cindex.CursorKind.CASE_STMT:
-                # print the case statement
-                # print the location of the case statement
-                foundIOCTLCase = False
-                for child in c.get_children():
-                    # print the case statement
-                    for token in child.get_tokens():
-                        # print("LINE: " + str(token.spelling) + " " + str(token.location.line))
-                        if IOCTL_NAME == str(token.spelling):
-                            self.logger.info(
-                                "[*] Found IOCTL [" + IOCTL_CMD + "] case Handler: " + str(token.spelling))
-                            # iterate through extent until you find a call expression to a function
-                            foundIOCTLCase = True
-                        break
-                    if foundIOCTLCase:
-                        foundIOCTLCase = False
-                        tokens = tu.get_tokens(extent=c.extent)
-                        CalleeDeclRefs = []
-                        for token in tokens:
-                            if token.kind == cindex.TokenKind.IDENTIFIER and token.cursor.kind == cindex.CursorKind.DECL_REF_EXPR \
-                                    and token.cursor.referenced.kind == cindex.CursorKind.FUNCTION_DECL:
-                                # fetch the function name
-                                FunctionName = str(token.spelling)
-                                if FunctionName == "copy_from_user" or FunctionName == "copy_to_user" or\
-                                    FunctionName == "get_user" or FunctionName == "put_user":
-                                    # we got it now
-                                    self.logger.info("[*] Found IOCTL case KERNEL COPY STMT: " + str(FunctionName))
-                                    for functionArg_token in tu.get_tokens(extent=token.cursor.referenced.extent):
-                                        if functionArg_token.kind == cindex.TokenKind.IDENTIFIER \
-                                                and functionArg_token.cursor.kind == cindex.CursorKind.PARM_DECL:
-                                            print("Function arg is " + str(functionArg_token.spelling))
-
-                                CalleeDeclRefs.append(token.cursor)
-
-                        # now we have all the decl refs that are function decls
-                        # lets iterate through them and fetch the function args
-                        TargetCursorDecl = self.findCursorToTargetFunction(IOCTL_CMD=IOCTL_CMD, tu=tu,
-                                                                               bfs=CalleeDeclRefs)
+        for case in self.tu_cache.case_index(_file).lookup(IOCTL_NAME):
+            self.logger.info("[*] Found IOCTL [" + IOCTL_CMD + "] case Handler: " + IOCTL_NAME)
+            CalleeDeclRefs = case.callees
+            for callee in CalleeDeclRefs:
+                if callee.spelling in COPY_FUNCTIONS:
+                    self.logger.info("[*] Found IOCTL case KERNEL COPY STMT: " + str(callee.spelling))
+            # now we have all the decl refs that are function decls
+            # lets iterate through them and fetch the function args
+            TargetCursorDecl = self.findCursorToTargetFunction(IOCTL_CMD=IOCTL_CMD, tu=tu,
+                                                               bfs=list(CalleeDeclRefs),
+                                                               copy_summaries=self.tu_cache.copy_summaries(_file))
 
         if TargetCursorDecl is None:
             return ""
         else:
             return TargetCursorDecl
 
-    def findCursorToTargetFunction(self, IOCTL_CMD, tu, bfs=[]):
-            # if bfs vector is not empty
-            if len(bfs) > 0:
-                while len(bfs) > 0:
-                    # pop the first element
-                    currentCursorDeclRef = bfs.pop(0)
-                    currentCursor = currentCursorDeclRef.referenced
-                    scope = currentCursor.referenced.extent
-                    # fetch the tokens from the scope and append to bfs
-                    FoundCallExpression = False
-                    FoundCallArgBracket = False
-                    FunctionName = ""
-                    for token in tu.get_tokens(extent=scope):
-                        # all function declrefs would be tokens of interests
-                        # print token cursor kind
-                        if FoundCallExpression == False:
-                            if token.kind == cindex.TokenKind.IDENTIFIER \
-                                    and token.cursor.kind == cindex.CursorKind.DECL_REF_EXPR \
-                                    and token.cursor.referenced.kind == cindex.CursorKind.FUNCTION_DECL:
-                                if token.spelling == "copy_from_user" or token.spelling == "copy_to_user"\
-                                        or token.spelling == "put_user" or token.spelling == "get_user":
-                                    # we found it
-                                    self.logger.critical(
-                                        "[*] Found IOCTL [" + IOCTL_CMD + "] case KERNEL COPY STMT: " + str(
-                                            token.spelling))
-                                    FunctionName = token.spelling
-                                    if FunctionName == "copy_from_user" or FunctionName == "get_user":
-                                        Direction = "in"
-                                    elif FunctionName == "copy_to_user" or FunctionName == "put_user":
-                                        Direction = "out"
-                                    FoundCallExpression = True
-                                else:
-                                    bfs.append(token.cursor)
-                        elif FoundCallArgBracket == False:
-                            if Direction == "in":
-                                if token.kind == cindex.TokenKind.PUNCTUATION and token.spelling == "(":  # first argument is the destination
-                                    FoundCallArgBracket = True
-                            elif Direction == "out":
-                                if token.kind == cindex.TokenKind.PUNCTUATION and token.spelling == ",":  # second argument is the destination
-                                    FoundCallArgBracket = True
-                        elif FoundCallArgBracket == True:
-                            if token.kind == cindex.TokenKind.IDENTIFIER and token.cursor.kind == cindex.CursorKind.DECL_REF_EXPR:
-                                # we found the argument
-                                ioctlArg = str(token.cursor.type.spelling)
-                                ioctlArgList = ioctlArg.split(" ")
-                                if ioctlArgList[0] == "struct" or ioctlArgList[0] == "union":
-                                    ioctlArg = ioctlArgList[1]
-                                elif ioctlArgList[0] == "unsigned":
-                                    ioctlArg = ioctlArgList[1]
-                                else:
-                                    ioctlArg = ioctlArgList[0].replace("*", "").replace("const", "").replace("volatile",
-                                                                                                             "")
-                                ioctlArg = ioctlArg.strip()
-                                self.logger.critical(
-                                    "[*] IOCTL [" + IOCTL_CMD + "] MARSHALL KS_US OBJ: " + str(ioctlArg))
-                                return ioctlArg + " " + Direction
-            else:
-                return None
+    def findCursorToTargetFunction(self, IOCTL_CMD, tu, bfs=[], copy_summaries=None):
+        """
+        Follow the calls made by an ioctl handler until one copies a typed argument from or to userspace,
+        with the copy summaries of the translation unit of the handler
+        :return: "<type> <direction>", or None
+        """
+        if len(bfs) == 0:
+            return None
+        summary = copy_summaries.search(bfs, tu)
+        self.logger.debug("[*] Copy summaries: %d reused, %d computed", copy_summaries.hits,
+                          copy_summaries.misses)
+        if summary is None:
+            return None
+        self.logger.critical("[*] Found IOCTL [" + IOCTL_CMD + "] case KERNEL COPY STMT: " + str(summary.copy_function))
+        self.logger.critical("[*] IOCTL [" + IOCTL_CMD + "] MARSHALL KS_US OBJ: " + str(summary.arg_type))
+        return summary.arg_type + " " + summary.direction
 
     def check_ioctl_switches(self, IOCTL_CMD, IOCTL_TRAP, file_):
         ''' Return (ioctl Call Name, (argument direction, argument type))
             Assumption - all case macros are defined in same header file
         '''
-        index = cindex.Index.create()
-        tunit = index.parse(file_)
-        root = tunit.cursor
+        tunit = self.tu_cache.get(file_)
 
         return self.traverse_and_find_trap_case(IOCTL_CMD=IOCTL_CMD, IOCTL_NAME=IOCTL_TRAP, tu=tunit, _file=file_)
     def syscall_run(self):
@@ -1248,8 +1447,7 @@ class Descriptions(object):
         for syscall in self.defines_dict.keys():
             syscall_args = {}
             target_file = self.defines_dict[syscall][0].split('/')[-1].split('.')[0]
-            xml_file = os.path.join(self.xml_dir, target_file+'.xml')
-            tree = ET.parse(join(self.xml_dir, xml_file))
+            tree = self.load_tree(target_file + '.xml')
             self.current_root = tree.getroot()
             self.current_file = os.path.dirname(self.xml_dir) + '/' + target_file + '.i'
             # self.current_fp = open(self.current_file,'r')
@@ -1278,4 +1476,5 @@ class Descriptions(object):
                             self.func_consts[syscall] = possible_const
                     break
             self.functions[syscall] = [syscall_args, None]
+        self.logger.info("[+] Type cache: %d hits, %d misses", self.type_cache_hits, self.type_cache_misses)
         return True
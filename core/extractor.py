@@ -8,7 +8,118 @@ from core.logger import get_logger
 from os.path import join, basename, isdir, isfile, exists
 import os
 import re
+import mmap
 import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+SourceRange = collections.namedtuple("SourceRange", ["filename", "start", "end", "structs", "handler"])
+
+
+class CSourceIndex(object):
+    """
+    The C files of a target, read once and indexed in a single pass: every case label and every function
+    definition is mapped to its line range, the structs and typedefs used in it and, for a case, the ioctl
+    handler it returns into
+    """
+    identifier = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+    case_label = re.compile(r"(?:case\s+(.+?)|default)\s*:(?!:)")
+    function_name = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+    struct_name = re.compile(r"\bstruct\s+([A-Za-z_][A-Za-z0-9_]*)")
+    handler_call = re.compile(r"\breturn\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+    keywords = {"if", "for", "while", "switch", "return", "sizeof"}
+
+    def __init__(self, target, typedefs, logger):
+        self.files = []
+        self.typedefs = set(typedefs)
+        # case label -> list of SourceRange, in file order
+        self.cases = {}
+        # function name -> SourceRange of its first definition
+        self.functions = {}
+        for filename in Utils.find_files(target, [".c"]):
+            try:
+                with open(join(target, filename), "r") as fd:
+                    lines = [line.strip() for line in fd]
+            except IOError:
+                logger.error("Unable to read the file '%s'", filename)
+                logger.critical("Skipping this file")
+                continue
+            self.files.append(filename)
+            self.index_file(filename, lines)
+
+    def types_used(self, text, structs):
+        """
+        Adds the structs and typedefs named in text to structs, keeping their order
+        """
+        names = self.struct_name.findall(text)
+        if self.typedefs:
+            names += [token for token in self.identifier.findall(text) if token in self.typedefs]
+        for name in names:
+            if name not in structs:
+                structs.append(name)
+
+    def index_file(self, filename, lines):
+        depth = 0
+        # name and first line of the function definition that may open at depth 0
+        signature = None
+        function = None
+        # case labels sharing a body: [labels, start, depth, structs, handler, has_body]
+        group = None
+
+        def close_case(end):
+            for label in group[0]:
+                self.cases.setdefault(label, []).append(
+                    SourceRange(filename, group[1], end, tuple(group[3]), group[4]))
+
+        for linenum, line in enumerate(lines):
+            if depth == 0 and not line.startswith("#"):
+                if signature is not None and signature[3] > 0:
+                    # parameters of a signature spanning several lines
+                    signature[3] += line.count("(") - line.count(")")
+                else:
+                    match = self.function_name.search(line)
+                    if match is not None and match.group(1) not in self.keywords:
+                        signature = [match.group(1), linenum, [], line.count("(") - line.count(")")]
+                if signature is not None and ("=" in line or (";" in line and "{" not in line)):
+                    # a prototype or a declaration, not a definition
+                    signature = None
+
+            body = line
+            label = self.case_label.match(line)
+            if label is not None:
+                if group is not None and group[5]:
+                    close_case(linenum - 1)
+                    group = None
+                if group is None:
+                    group = [[], linenum, depth, [], None, False]
+                if label.group(1) is not None:
+                    group[0].extend(self.identifier.findall(label.group(1)))
+                body = line[label.end():]
+
+            if group is not None:
+                self.types_used(body, group[3])
+                if "return" in body and "(" in body and "ioctl" in body:
+                    call = self.handler_call.search(body)
+                    if call is not None and group[4] is None:
+                        group[4] = call.group(1)
+                if body not in ("", "{"):
+                    group[5] = True
+            if depth > 0 and function is not None:
+                self.types_used(line, function[2])
+
+            depth = max(0, depth + line.count("{") - line.count("}"))
+            if group is not None and ("break" in body or "return" in body or depth < group[2]):
+                close_case(linenum)
+                group = None
+            if function is None and signature is not None and depth > 0:
+                function = signature
+                signature = None
+            elif function is not None and depth == 0:
+                name, start, structs, _ = function
+                self.functions.setdefault(name, SourceRange(filename, start, linenum, tuple(structs), None))
+                function = None
+        if group is not None:
+            close_case(len(lines) - 1)
 
 
 class Ioctl(object):
@@ -37,132 +148,49 @@ class Ioctl(object):
 
     def c_files(self) -> list:
         """
-        Find all the header files in device folder
-        :return: list of header files
+        Find all the C files under the device folder
+        :return: list of C files, relative to the device folder
         """
-        c_files = []
-        for filename in os.listdir(self.target):
-            # store all the filenames ending with ".h" in an array
-            if filename.endswith('.c'):
-                c_files.append(filename)
-        return c_files
+        return Utils.find_files(self.target, [".c"])
 
     def get_linux_ioctl_structs(self, ioctl_cmd, NeedToCheckIoctlHandler=False, ioctl_handler_func_name = "") -> str:
         # NeedToCheckIoctlHandler is a variable that is set, if no structs were found in the vicinity of the ioctl handler
         # which would allow us to generate a description for this ioctl
-        # This is by default false, and is set to true if no structs are found in the vicinity of the ioctl handler
-        # following which, once again all c files will be searched for this ioctl handler, and
-        # structs will be looked for within the function scope of the ioctl handler
-        # iterate through all the .c files
-        for c_file in self.c_files():
-            # Iterate through all lines in the c files
-            try:
-                fd = open(join(self.target, c_file), "r")
-                content = fd.readlines()
-                fd.close()
-            except IOError:
-                self.logger.error("Unable to read the file '%s'", c_file)
-                self.logger.critical("Skipping this file")
-                continue
-
-            isInsideCase = False
-            isDetected = False
-            for line in iter(content):
-                line = line.strip()
-                if not isDetected and not isInsideCase:
-                    if not NeedToCheckIoctlHandler:
-                        if "case" in line and ioctl_cmd in line:
-                            print("Found the case statement as " + str(line))
-                            isDetected = True
-                            continue
-                    else:
-                        if ioctl_handler_func_name in line and "return" not in line: #look for definitions and not calls
-                            print("Found the ioctl handler as " + str(line))
-                            isDetected = True
-                            continue
-                elif isDetected:
-                    isInsideCase = True
-                    # print the line
-                    print(str(line))
-                    if "return" in line:
-                        # check if line contains ( and )
-                        if "(" in line and ")" and "ioctl" in line: # this means this is a call into the ioctl handler
-                            if self.description is None:
-                                # split the line based on space
-                                ioctl_handler = line.split(" ")
-                                # get the second element of the array
-                                ioctl_handler_func = ioctl_handler[1]
-                                # crop ioctl_handler_func based on the second occurrence of (
-                                ioctl_handler_func = ioctl_handler_func.split("(")[0]
-                                # now remove "(" and ")" from the string
-                                ioctl_handler_func = ioctl_handler_func.replace("(", "")
-                                # strip spaces
-                                ioctl_handler_func = ioctl_handler_func.strip()
-                                # prompt the user if he wants to look into the ioctl handler
-                                print("No struct found in the vicinity of ioctl command " + self.command)
-                                print("However..Do you want to look into the ioctl handler ( " + ioctl_handler_func + " ) ? (y/n)")
-                                # while the user input is not y or n, keep prompting
-                                while True:
-                                    user_input = input()
-                                    if user_input == "y":
-                                        print("Looking into the ioctl handler")
-                                        self.description = self.get_linux_ioctl_structs(ioctl_cmd, True, ioctl_handler_func)
-                                        break
-                                    elif user_input == "n":
-                                        print("Not looking into the ioctl handler")
-                                        return ""
-                                    else:
-                                        print("Please enter y or n")
-                                break
-                        else:
-                            isInsideCase = False
-                            break
-                    if "}" in line:
-                        isInsideCase = False
-                        if self.description is None:
-                            # keep looking for another case handler.
-                            # the correct case statement for the ioctl command would never break away without a self description or a call to the ioctl handler
-                            continue
-                        break
-                    if "break" in line:
-                        isInsideCase = False
-                        if self.description is None:
-                            # keep looking for another case handler.
-                            # the correct case statement for the ioctl command would never break away without a self description or a call to the ioctl handler
-                            continue
-                        break
-                    if "struct " in line or any(x in line for x in self.typedefs):
-                        print("TYPEDEF LISTS ARE --> " + str(self.typedefs))
-                        # split the line based on spaces
-                        line_list = line.split(" ")
-                        #print the list
-                        print(str(line_list))
-                        #iterate through the line_list and find the struct
-                        for element in line_list:
-                            print("The element is " + str(element))
-                            if "struct" in element and ("(" and ")") not in element:
-                                # get the index of the element
-                                index = line_list.index(element)
-                                # get the next element
-                                struct_name = line_list[index + 1]
-                                struct_name = struct_name.strip()
-                            elif any(x in element for x in self.typedefs):
-                                # fetch matching typedef
-                                for typedef in self.typedefs:
-                                    if typedef in element:
-                                        struct_name = typedef
-                                        print("The typedef name is " + str(struct_name))
-
-                        print("The ioctl call " + self.command + " is using the struct : " + struct_name)
-                        if self.description is None:
-                            self.description = [str(struct_name)]
-                        else:
-                            self.description.append(struct_name)
-            if isDetected and not isInsideCase:
+        # This is by default false, and is set to true if no structs are found in the case of the ioctl command,
+        # following which the structs are looked for within the function scope of the ioctl handler
+        # both come from the index of the target's c files, no file is read again
+        source_index = self.sysobj.extractor.c_source_index(self.target)
+        if NeedToCheckIoctlHandler:
+            handler = source_index.functions.get(ioctl_handler_func_name)
+            if handler is None:
+                return None
+            print("Found the ioctl handler " + ioctl_handler_func_name + " in " + handler.filename)
+            return list(handler.structs) or None
+
+        self.description = None
+        for case in source_index.cases.get(ioctl_cmd, []):
+            print("Found the case statement for " + ioctl_cmd + " in " + case.filename)
+            if case.structs:
+                print("The ioctl call " + self.command + " is using the structs : " + str(list(case.structs)))
+                self.description = list(case.structs)
+                break
+            if case.handler is not None:
+                # prompt the user if he wants to look into the ioctl handler
+                print("No struct found in the vicinity of ioctl command " + self.command)
+                print("However..Do you want to look into the ioctl handler ( " + case.handler + " ) ? (y/n)")
+                user_input = self.sysobj.decisions.ask(
+                    "handler:" + self.command + ":" + case.handler, "(y/n): ", ["y", "n"],
+                    {"first": "y", "int64": "y", "reject": "n"})
+                if user_input == "y":
+                    print("Looking into the ioctl handler")
+                    self.description = self.get_linux_ioctl_structs(ioctl_cmd, True, case.handler)
+                else:
+                    print("Not looking into the ioctl handler")
+                    return ""
                 break
+            # keep looking for another case handler.
+            # the correct case statement for the ioctl command would never break away without a struct or a call to the ioctl handler
 
-        if NeedToCheckIoctlHandler:
-            return self.description
         if self.description is None:
             print("No struct found in the vicinity of ioctl command " + self.command)
             return "long"  # defaults to long
@@ -176,41 +204,119 @@ class Ioctl(object):
             print("The ioctl command " + self.command + " is using the following structs : " + str(self.description))
             for i in range(len(self.description)):
                 print(str(i) + " : " + self.description[i])
-            selected_struct = input("Please enter the struct index OR (-1) to exit /(-2) default to long : ")
-            while selected_struct not in [str(i) for i in range(len(self.description))] and selected_struct not in ["-1", "-2"]:
-                selected_struct = input("Please enter the struct index OR (-1) to exit /(-2) default to long : ")
+            # the struct name is recorded, its index changes with the sources
+            selected_struct = self.sysobj.decisions.ask(
+                "struct:" + self.command, "Please enter the struct index OR (-1) to exit /(-2) default to long : ",
+                self.description + ["-1", "-2"],
+                {"first": self.description[0], "int64": "-2", "reject": "-1"},
+                {str(i): struct for i, struct in enumerate(self.description)})
             if selected_struct == "-1":
                 return ""
             elif selected_struct == "-2":
                 return "int64"
-            self.description = self.description[int(selected_struct)]
+            self.description = selected_struct
         return str(self.description)
 
 
+def split_macro_args(text) -> list:
+    """
+    Split the arguments of a macro call, text starts after the opening parenthesis.
+    Commas nested in parentheses or quotes don't split.
+    :return: list of arguments, or None if the call is not closed on this line
+    """
+    args = []
+    depth = 0
+    quote = None
+    start = 0
+    for pos, char in enumerate(text):
+        if quote is not None:
+            if char == quote and text[pos - 1] != "\\":
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            if depth == 0:
+                args.append(text[start:pos])
+                return args
+            depth -= 1
+        elif char == "," and depth == 0:
+            args.append(text[start:pos])
+            start = pos + 1
+    return None
+
+
+class IoctlScanner(object):
+    """
+    Finds the ioctl command definitions of header files. Lines that contain neither "#define" nor "_IO"
+    are rejected with a substring test, the others are classified by a single pattern and the
+    arguments of the _IO* call are split by walking the parentheses instead of backtracking.
+    """
+    pattern = re.compile(
+        r"#define\s+(?P<name>[^\s(]+(?:\([^)]*\))?)\s+_IO(?P<dir>WR|R|W)?\((?P<args>.*)"  # _IO, _IOR, _IOW, _IOWR
+        r"|(?P<trap>(?i:#define\s+[A-Za-z0-9_]+\s+0x[0-9]))"  # ioctl trap numbers
+        r"|(?i:\s*[A-Za-z0-9]+_IO(?P<cont_dir>WR|R|W)\(\s*0x[0-9]*\s*\\*,\s*\\*\s*(?P<cont_arg>.*))"  # amdkfd style
+    )
+    directions = {None: Ioctl.IO, "R": Ioctl.IOR, "W": Ioctl.IOW, "WR": Ioctl.IOWR}
+
+    def __init__(self, os_type, ioctl_trap_prefix=None):
+        self.os_type = os_type
+        self.ioctl_trap_prefix = ioctl_trap_prefix
+        # name of the last #define, amdkfd style commands continue it on the next line
+        self.line_cont = ""
+
+    def scan(self, lines):
+        """
+        Yields the ioctls defined by lines, a None type marks a line that only identifies an ioctl header
+        :return: generator of (type, command, argument, trap)
+        """
+        for line in lines:
+            if "#define" not in line and "_IO" not in line:
+                continue
+            match = self.pattern.match(line)
+            if match is not None and match.group("name") is not None:
+                args = split_macro_args(match.group("args"))
+                direction = match.group("dir")
+                if args is not None and (direction is None or len(args) >= 3):
+                    argument = None if direction is None else args[-1].lstrip()
+                    yield self.directions[direction], match.group("name"), argument, 0
+                    continue
+                match = None
+            if self.os_type != 2:
+                continue
+            if match is not None and match.group("trap") is not None and self.ioctl_trap_prefix is not None:
+                # get the line as a string
+                line = line.strip()
+                trap_index = str(self.ioctl_trap_prefix)
+                if trap_index in line:
+                    # the word containing the trap index is the IOCTL TRAP NAME
+                    for word in line.split():
+                        if trap_index in word:
+                            ioctl_trap = word
+                    yield Ioctl.LNX, line.split()[1].strip(), None, ioctl_trap
+                else:
+                    yield None, None, None, 0
+                continue
+            if "#define" in line:
+                # temporarily store this line, without "#define" and "\"
+                self.line_cont = line.replace("#define", "").replace("\\", "").strip()
+            if match is not None and match.group("cont_dir") is not None:
+                argument = match.group("cont_arg").replace("\\", "").replace(")", "").strip()
+                yield self.directions[match.group("cont_dir")], self.line_cont, argument, 0
+
+
 class Extractor(object):
     # define a regex map for the ioctls corresponding to OS
     ioctl_regex_map = {
         1: "linux_type", 2: "linux_type"
     }
 
-    # define regex for the different variations of all the ioctl commands found accross the supported OSes
-    ioctl_regex_type = {
-        "linux_type": {
-            "io": re.compile(r"#define\s+(.*)\s+_IO\((.*)\).*"),  # regex for IO_
-            "iow": re.compile(r"#define\s+(.*)\s+_IOW\((.*),\s+(.*),\s+(.*)\).*"),  # regex for IOW_
-            "ior": re.compile(r"#define\s+(.*)\s+_IOR\((.*),\s+(.*),\s+(.*)\).*"),  # regex for IOR_
-            "iowr": re.compile(r"#define\s+(.*)\s+_IOWR\((.*),\s+(.*),\s+(.*)\).*"),  # regex for IOWR_
-            "lnx": re.compile(r"#define\s+[A-Za-z0-9_]+\s+0x[0-9]+", re.IGNORECASE),
-            "lnx_amdkfd_ior": re.compile(r"\s*[A-Za-z0-9]+_IOR\(\s*0x[0-9]*\s*\\*,\s*\\*\s*(.*)", re.IGNORECASE),
-            "lnx_amdkfd_iow": re.compile(r"\s*[A-Za-z0-9]+_IOW\(\s*0x[0-9]*\s*\\*,\s*\\*\s*(.*)", re.IGNORECASE),
-            "lnx_amdkfd_iowr": re.compile(r"\s*[A-Za-z0-9]+_IOWR\(\s*0x[0-9]*\s*\\*,\s*\\*\s*(.*)", re.IGNORECASE)
-        }
-    }
-
     # io = re.compile(r"#define\s+(.*)\s+_IO\((.*)\).*") # regex for IO_
     # iow = re.compile(r"#define\s+(.*)\s+_IOW\((.*),\s+(.*),\s+(.*)\).*") #regex for IOW_
     # ior = re.compile(r"#define\s+(.*)\s+_IOR\((.*),\s+(.*),\s+(.*)\).*") #regex for IOR_
     # iowr = re.compile(r"#define\s+(.*)\s+_IOWR\((.*),\s+(.*),\s+(.*)\).*") #regex for IOWR_
+    include_regex = re.compile(r'^\s*#\s*include\s*([<"])([^>"]+)[>"]', re.MULTILINE)
     macros = re.compile(r"#define\s*\t*([A-Z_0-9]*)\t*\s*.*")
     more_macros = re.compile(
         r"#define(\s|\t)+([A-Z_0-9]*)[\t|\s]+(?!_IOWR|_IOR|_IOW|_IO|\()[0-9]*x?[a-z0-9]*")  # define(\s|\t)+([A-Z_0-9]*)[\t\s]+([^_IOWR{][0-9]*)")#define(\s|\t)+([^_][A-Z_0-9]*)\t*\s*.*")
@@ -221,7 +327,12 @@ class Extractor(object):
             self.ioctl_trap_prefix = sysobj.ioctl_trap_prefix
         self.sysobj = sysobj
         self.target = sysobj.target
-        self.files = os.listdir(self.target)
+        self.header_paths = None
+        # headers found outside of the target directory, named as the target sources include them
+        self.outside_headers = set()
+        # header path -> (ioctls, macros) read during the header discovery, consumed by scan_headers
+        self.header_scans = {}
+        self.header_macros = None
         self.logger = get_logger("Extractor", sysobj.log_level)
         self.os_type = sysobj.os_type
         self.ioctl_type = self.ioctl_regex_map[self.os_type]
@@ -232,120 +343,189 @@ class Extractor(object):
         if not exists(self.target_dir):
             os.mkdir(self.target_dir)
         self.ioctl_file = ""
+        self.c_sources = {}
+
+    def c_source_index(self, target) -> CSourceIndex:
+        """
+        Index of the C files of a target, built on first use and shared by all the ioctls
+        :return: CSourceIndex
+        """
+        if target not in self.c_sources:
+            self.c_sources[target] = CSourceIndex(target, self.typedefs, self.logger)
+        return self.c_sources[target]
 
     def get_ioctls(self):
         """
         Fetch the ioctl commands with their arguments and sort them on the basis of their type
         :return:
         """
-        lineCont = ""
+        self.header_macros = set()
+        for file, gtype, command, description, ioctl_trap in self.scan_headers(self.header_macros):
+            if gtype is not None:
+                self.ioctls.append(Ioctl(gtype, file, command, description, self.sysobj, self.sysobj.target,
+                                         ioctl_trap))
+            self.ioctls_headers.append(file)
+
+    @staticmethod
+    def marked_lines(path, marks):
+        """
+        Memory maps a file and yields the lines containing one of the byte strings of marks.
+        Other lines are never decoded.
+        :return: generator of lines
+        """
+        with open(path, "rb") as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                size = len(buf)
+                found = [buf.find(mark) for mark in marks]
+                while True:
+                    pending = [pos for pos in found if pos >= 0]
+                    if not pending:
+                        break
+                    pos = min(pending)
+                    start = buf.rfind(b"\n", 0, pos) + 1
+                    end = buf.find(b"\n", pos)
+                    end = size if end < 0 else end + 1
+                    # skip the other marks of this line
+                    for i, mark in enumerate(marks):
+                        if 0 <= found[i] < end:
+                            found[i] = buf.find(mark, end)
+                    yield buf[start:end].decode("utf-8", "replace")
+
+    def header_lines(self, path, macros):
+        """
+        Memory maps a header and yields the lines that can define an ioctl, the macros defined
+        on the way are added to macros
+        :return: generator of lines
+        """
+        for line in self.marked_lines(path, (b"#define", b"_IO")):
+            if "#define" in line:
+                macros.update(self.macros.findall(line))
+            yield line
+
+    def scan_headers(self, macros):
+        """
+        Single pass over the headers of the target, yielding the ioctls as they are found and
+        collecting the macros defined by the headers into macros
+        :return: generator of (header, type, command, argument, trap)
+        """
+        scanner = IoctlScanner(self.os_type, self.ioctl_trap_prefix if self.os_type == 2 else None)
         for file in self.header_files:
+            print("Processing file : " + file)
+            path = self.header_path(file)
+            if path in self.header_scans:
+                # already read by the header discovery
+                found, defined = self.header_scans.pop(path)
+                macros.update(defined)
+                for gtype, command, description, ioctl_trap in found:
+                    yield file, gtype, command, description, ioctl_trap
+                continue
             try:
-                fd = open(join(self.target, file), "r")
-                # print filename
-                print("Processing file : " + file)
-                content = fd.readlines()
-                fd.close()
-            except IOError:
+                for gtype, command, description, ioctl_trap in scanner.scan(self.header_lines(path, macros)):
+                    yield file, gtype, command, description, ioctl_trap
+            except (IOError, ValueError):
                 self.logger.error("Unable to read the file '%s'", file)
                 self.logger.critical("Skipping this file")
-                continue
-
-            for line in content:
-                io_match = self.ioctl_regex_type[self.ioctl_type]["io"].match(line)
-                if io_match:
-                    self.ioctls.append(
-                        Ioctl(Ioctl.IO, file, io_match.groups()[0].strip(), None, self.sysobj, self.sysobj.target))
-                    self.ioctls_headers.append(file)
-                    continue
-
-                ior_match = self.ioctl_regex_type[self.ioctl_type]["ior"].match(line)
-                if ior_match:
-                    self.ioctls.append(
-                        Ioctl(Ioctl.IOR, file, ior_match.groups()[0].strip(), ior_match.groups()[-1], self.sysobj,
-                              self.sysobj.target))
-                    self.ioctls_headers.append(file)
-                    continue
-
-                iow_match = self.ioctl_regex_type[self.ioctl_type]["iow"].match(line)
-                if iow_match:
-                    self.ioctls.append(
-                        Ioctl(Ioctl.IOW, file, iow_match.groups()[0].strip(), iow_match.groups()[-1], self.sysobj,
-                              self.sysobj.target))
-                    self.ioctls_headers.append(file)
-                    continue
-
-                iowr_match = self.ioctl_regex_type[self.ioctl_type]["iowr"].match(line)
-                if iowr_match:
-                    self.ioctls.append(
-                        Ioctl(Ioctl.IOWR, file, iowr_match.groups()[0].strip(), iowr_match.groups()[-1], self.sysobj,
-                              self.sysobj.target))
-                    self.ioctls_headers.append(file)
-                    continue
-                if self.os_type == 2 and self.ioctl_regex_type[self.ioctl_type]["lnx"].match(line) \
-                        and self.ioctl_trap_prefix is not None:
-                    # get the line as a string
-                    line = line.strip()
-                    trap_index = str(self.ioctl_trap_prefix)
-                    # check if trap_index is a substring of line
-                    if trap_index in line:
-                        # fetch space separated words
-                        words = line.split()
-                        # the last word is the IOCTL TRAP NUMBER
-                        # the word containing the trap index is the IOCTL TRAP NAME
-                        for word in words:
-                            if trap_index in word:
-                                ioctl_trap = word
-                                ioctl_trap = ioctl_trap
-                        # print ioctl name and trap
-                        self.ioctls.append(
-                        Ioctl(Ioctl.LNX, file, line.split()[1].strip(), None, self.sysobj, self.sysobj.target, ioctl_trap))
-                    self.ioctls_headers.append(file)
-                    continue
-                if self.os_type == 2:
-
-                    if "\\" and "#define" in line:
-                        #temporarily store this line
-                        #remove "#define" and "\"
-                        lineCont = line.replace("#define", "")
-                        lineCont = lineCont.replace("\\", "")
-                        lineCont = lineCont.strip()
-
-                    ior_match = self.ioctl_regex_type[self.ioctl_type]["lnx_amdkfd_ior"].match(line)
-                    if ior_match:
-                        self.ioctls.append(
-                            Ioctl(Ioctl.IOR, file, lineCont, ior_match.groups()[-1].replace("\\", "").replace(")", "").strip(), self.sysobj,
-                                  self.sysobj.target))
-                        self.ioctls_headers.append(file)
-                        continue
-                    iow_match = self.ioctl_regex_type[self.ioctl_type]["lnx_amdkfd_iow"].match(line)
-                    if iow_match:
-                        self.ioctls.append(
-                            Ioctl(Ioctl.IOW, file, lineCont, iow_match.groups()[-1].replace("\\", "").replace(")", "").strip(), self.sysobj,
-                                  self.sysobj.target))
-                        self.ioctls_headers.append(file)
-                        continue
-                    iowr_match = self.ioctl_regex_type[self.ioctl_type]["lnx_amdkfd_iowr"].match(line)
-                    if iowr_match:
-                        self.ioctls.append(
-                            Ioctl(Ioctl.IOWR, file, lineCont, iowr_match.groups()[-1].replace("\\", "").replace(")", "").strip(), self.sysobj,
-                                  self.sysobj.target))
-                        self.ioctls_headers.append(file)
-                        continue
-
 
     @property
     def header_files(self) -> list:
         """
-        Find all the header files in device folder
+        Find all the header files of the device, discovered once
         :return: list of header files
         """
-        header_files = []
-        for filename in self.files:
-            # store all the filenames ending with ".h" in an array
-            if filename.endswith('.h'):
-                header_files.append(filename)
-        return header_files
+        if self.header_paths is None:
+            self.header_paths = self.discover_headers()
+        return list(self.header_paths)
+
+    def header_path(self, name) -> str:
+        return self.header_paths.get(name, join(self.target, name))
+
+    def scan_header_source(self, path):
+        """
+        Read a source or header file for header discovery. Only the #include lines of a source
+        are decoded, a header is also scanned for ioctls and macros, kept in self.header_scans
+        for scan_headers so that it is not read again.
+        :return: (list of (delimiter, included path), True if the file defines ioctls)
+        """
+        is_header = path.endswith(".h")
+        marks = (b"include", b"#define", b"_IO") if is_header else (b"include",)
+        includes = []
+        lines = []
+        try:
+            for line in self.marked_lines(path, marks):
+                if "include" in line:
+                    includes.extend(self.include_regex.findall(line))
+                lines.append(line)
+        except (IOError, ValueError):
+            self.logger.error("Unable to read the file '%s'", path)
+            return [], False
+        if not is_header:
+            return includes, False
+        macros = set()
+        for line in lines:
+            if "#define" in line:
+                macros.update(self.macros.findall(line))
+        scanner = IoctlScanner(self.os_type, self.ioctl_trap_prefix if self.os_type == 2 else None)
+        found = list(scanner.scan(lines))
+        self.header_scans[path] = (found, macros)
+        return includes, any(gtype is not None for gtype, _, _, _ in found)
+
+    @staticmethod
+    def resolve_include(source, delimiter, include, include_dirs) -> str:
+        if delimiter == '"':
+            path = join(os.path.dirname(source), include)
+            if isfile(path):
+                return os.path.normpath(path)
+        for include_dir in include_dirs:
+            path = join(include_dir, include)
+            if isfile(path):
+                return os.path.normpath(path)
+        return None
+
+    def discover_headers(self) -> dict:
+        """
+        Find the headers of the target: every header under the target directory, plus the headers
+        outside of it that the target sources include, through the include directories recorded in
+        compile_commands.json, and that define ioctls. Files are scanned by self.sysobj.jobs threads.
+        :return: dict of header name -> path, names are relative to the target or spelled as included,
+        the latter are also added to self.outside_headers
+        """
+        target = os.path.realpath(self.target)
+        header_paths = collections.OrderedDict()
+        for name in Utils.find_files(target, [".h"]):
+            header_paths[name] = join(target, name)
+        local_headers = len(header_paths)
+
+        sources = [join(target, name) for name in Utils.find_files(target, [".c", ".h"])]
+        include_dirs = self.sysobj.bear.include_dirs() if hasattr(self.sysobj, "bear") else []
+        with ThreadPoolExecutor(max_workers=self.sysobj.jobs) as pool:
+            scanned = list(pool.map(self.scan_header_source, sources))
+
+            # follow the include edges leaving the target, a header included with different
+            # spellings is kept once under its first spelling
+            outside = {}
+            for source, (includes, _) in zip(sources, scanned):
+                for delimiter, include in includes:
+                    path = self.resolve_include(source, delimiter, include, include_dirs)
+                    if path is None:
+                        continue
+                    path = os.path.realpath(path)
+                    if path.startswith(target + os.sep) or include in header_paths:
+                        continue
+                    outside.setdefault(path, include)
+            paths = sorted(outside, key=outside.get)
+            results = pool.map(self.scan_header_source, paths)
+            for path, (_, defines_ioctls) in zip(paths, results):
+                if defines_ioctls:
+                    header_paths[outside[path]] = path
+                    self.outside_headers.add(outside[path])
+                else:
+                    self.header_scans.pop(path, None)
+
+        self.logger.info("[+] Found %d header files, %d of them outside the target, using %d include directories",
+                         len(header_paths), len(header_paths) - local_headers, len(include_dirs))
+        return header_paths
 
     @property
     def command_macros(self) -> list:
@@ -376,15 +556,12 @@ class Extractor(object):
         Fetch all the macros defined
         :return:
         """
-        undefined_macros = []
-        # read all the files present in target
-        for file in self.header_files:
-            try:
-                buf = open(join(self.target, file), 'r').read()
-                undefined_macros.extend(self.macros.findall(buf))
-            except IOError:
-                self.logger.error("Unable to open " + join(self.target, file))
-
+        if self.header_macros is None:
+            # get_ioctls did not run, the headers still have to be read once
+            self.header_macros = set()
+            for _ in self.scan_headers(self.header_macros):
+                pass
+        undefined_macros = self.header_macros
         # return the macros found, except the IOCTL command macros in header files
         return list(set(undefined_macros) - set(self.command_macros))
     def flag_details(self, flags_defined):
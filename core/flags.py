@@ -0,0 +1,240 @@
+# Module : Flags.py
+# Description : Line ordered index of the groups of flag macros of a preprocessed file, and a trigram
+#               index of their names for the fuzzy prediction of the groups matching a struct
+from bisect import bisect_left, bisect_right
+import heapq
+
+from fuzzywuzzy import fuzz, utils
+
+MATCH_LIMIT = 5
+MATCH_SCORE = 50
+
+
+class FlagGroupIndex(object):
+    """
+    Flag groups of a file, as produced by Extractor.flag_details: (macros, start line, end line).
+    Groups are kept sorted by line, they don't overlap so both their starts and ends are sorted.
+    Consumed groups are tombstoned, lookups skip them through path compressed links to the
+    nearest live group on each side.
+    """
+
+    def __init__(self, groups):
+        self.groups = sorted(groups, key=lambda group: group[1])
+        self.starts = [group[1] for group in self.groups]
+        self.ends = [group[2] for group in self.groups]
+        count = len(self.groups)
+        # next_live[i]: first live group >= i, prev_live[i + 1]: last live group <= i (0 and count are sentinels)
+        self.next_live = list(range(count + 1))
+        self.prev_live = list(range(count + 1))
+
+    def __len__(self):
+        return len(self.groups)
+
+    def _find(self, links, i) -> int:
+        root = i
+        while links[root] != root:
+            root = links[root]
+        while links[i] != root:
+            links[i], i = root, links[i]
+        return root
+
+    def first_live(self, i) -> int:
+        """
+        First live group at or after position i
+        :return: position, or None
+        """
+        i = self._find(self.next_live, i)
+        return i if i < len(self.groups) else None
+
+    def last_live(self, i) -> int:
+        """
+        Last live group at or before position i
+        :return: position, or None
+        """
+        if i < 0:
+            return None
+        i = self._find(self.prev_live, i + 1)
+        return i - 1 if i > 0 else None
+
+    def consume(self, i):
+        """Tombstone a group, it is never returned again"""
+        self.next_live[i] = i + 1
+        self.prev_live[i + 1] = i
+
+    def macros(self, i) -> list:
+        return self.groups[i][0]
+
+    def within(self, low, high) -> int:
+        """
+        First live group starting at or after line low and ending before line high
+        :return: position, or None
+        """
+        i = self.first_live(bisect_left(self.starts, low))
+        if i is not None and self.ends[i] < high:
+            return i
+        return None
+
+    def after(self, line) -> int:
+        """
+        Nearest live group starting at or after line
+        :return: position, or None
+        """
+        return self.first_live(bisect_left(self.starts, line))
+
+    def before(self, line) -> int:
+        """
+        Nearest live group ending at or before line
+        :return: position, or None
+        """
+        return self.last_live(bisect_right(self.ends, line) - 1)
+
+    def live(self):
+        """
+        Live groups in line order
+        :return: generator of (position, macros)
+        """
+        i = self.first_live(0)
+        while i is not None:
+            yield i, self.groups[i][0]
+            i = self.first_live(i + 1)
+
+
+def trigrams(text) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def partial_ratio_bound(query, query_counts, name) -> int:
+    """
+    Upper bound of fuzz.partial_ratio(query, name) from character counts only.
+    partial_ratio compares the shorter string with windows of its length over the longer one, the
+    windows that would run past the end are cut short. A window can't match more characters than
+    the multiset intersection of both, which is maintained while sliding over the longer string.
+    :return: score the real ratio can't exceed
+    """
+    if len(query) <= len(name):
+        shorter, shorter_counts, longer = query, query_counts, name
+    else:
+        shorter, longer = name, query
+        shorter_counts = {}
+        for char in shorter:
+            shorter_counts[char] = shorter_counts.get(char, 0) + 1
+    size = len(shorter)
+    if size == 0:
+        return 0
+
+    best = 0
+    common = 0
+    window = {}
+    for i, char in enumerate(longer):
+        count = window.get(char, 0)
+        if count < shorter_counts.get(char, 0):
+            common += 1
+        window[char] = count + 1
+        if i >= size:
+            out = longer[i - size]
+            count = window[out] - 1
+            window[out] = count
+            if count < shorter_counts.get(out, 0):
+                common -= 1
+        if i >= size - 1 and common > best:
+            best = common
+    ratio = best / size
+
+    # windows cut short by the end of the longer string
+    common = 0
+    window = {}
+    for length in range(1, min(size, len(longer) + 1)):
+        char = longer[-length]
+        count = window.get(char, 0)
+        if count < shorter_counts.get(char, 0):
+            common += 1
+        window[char] = count + 1
+        ratio = max(ratio, 2.0 * common / (size + length))
+    return utils.intr(100 * ratio)
+
+
+class FlagNameIndex(object):
+    """
+    Character trigram index of the macro names of the flag groups of a file, ranking the live groups
+    against a struct name the way process.extract(name, macros, scorer=fuzz.partial_ratio) does.
+    Names sharing a trigram with the struct name are scored first, the others only while an upper
+    bound of their score can still place them in the top results, so the ranking is unchanged.
+    Scores don't depend on which groups are live and are kept for the whole run.
+    The trigrams only order the candidates: partial_ratio reaches MATCH_SCORE on names sharing no
+    trigram with the struct name, so prepare still bounds every (struct, name) pair and its cost
+    stays O(structs x macros x name length). What is saved is the partial_ratio calls, which the
+    bounds rule out for most pairs.
+    """
+
+    def __init__(self, flag_groups):
+        self.flag_groups = flag_groups
+        # (group position, lowercase name, processed name) in the order process.extract would see them
+        self.occurrences = []
+        self.by_name = {}
+        self.grams = {}
+        for position, group in enumerate(flag_groups.groups):
+            for macro in group[0]:
+                name = macro.lower()
+                processed = utils.full_process(name)
+                self.occurrences.append((position, name, processed))
+                self.by_name.setdefault(processed, []).append(len(self.occurrences) - 1)
+        for processed in self.by_name:
+            for gram in trigrams(processed):
+                self.grams.setdefault(gram, set()).add(processed)
+        self.plans = {}
+        self.scores = {}
+
+    def prepare(self, queries):
+        """
+        Order the candidate names of every query at once, the ones that can't reach MATCH_SCORE are left out
+        """
+        for query in queries:
+            if query in self.plans:
+                continue
+            processed = utils.full_process(query)
+            counts = {}
+            for char in processed:
+                counts[char] = counts.get(char, 0) + 1
+            shortlist = set()
+            for gram in trigrams(processed):
+                shortlist |= self.grams.get(gram, set())
+            plan = []
+            if processed:
+                for name in self.by_name:
+                    bound = partial_ratio_bound(processed, counts, name)
+                    if bound >= MATCH_SCORE:
+                        plan.append((-bound, name not in shortlist, name))
+            plan.sort()
+            self.plans[query] = (processed, [(-bound, name) for bound, _, name in plan])
+            self.scores[query] = {}
+
+    def rank(self, query) -> list:
+        """
+        Best matches of a struct name among the macros of the live groups
+        :return: list of lowercase macro names, best first
+        """
+        self.prepare([query])
+        processed, plan = self.plans[query]
+        scores = self.scores[query]
+        live = set(position for position, _ in self.flag_groups.live())
+        # lowest of the best MATCH_LIMIT scores of the live occurrences scored so far
+        best = []
+        ranked = []
+        for bound, name in plan:
+            if len(best) == MATCH_LIMIT and bound < best[0]:
+                break
+            score = scores.get(name)
+            if score is None:
+                score = fuzz.partial_ratio(processed, name)
+                scores[name] = score
+            for occurrence in self.by_name[name]:
+                if self.occurrences[occurrence][0] not in live:
+                    continue
+                ranked.append((-score, occurrence))
+                if len(best) < MATCH_LIMIT:
+                    heapq.heappush(best, score)
+                elif score > best[0]:
+                    heapq.heapreplace(best, score)
+        ranked.sort()
+        return [self.occurrences[occurrence][1] for score, occurrence in ranked[:MATCH_LIMIT]
+                if -score >= MATCH_SCORE]
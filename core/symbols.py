@@ -0,0 +1,126 @@
+# Module : Symbols.py
+# Description : Lookup tables over the c2xml trees, built once instead of scanning the trees for every lookup
+from array import array
+from bisect import bisect_left
+
+
+class RootIndex(object):
+    """Lookup tables for the nodes of a single XML root"""
+
+    def __init__(self, root):
+        self.root = root
+        # start lines of the top level nodes in ascending order, with their document positions and nodes
+        self.line_starts = None
+        self.line_positions = None
+        self.line_nodes = None
+        # id -> node, top level nodes take precedence over their children
+        self.ids = {}
+        # ident -> node, a top level node followed by its children, in document order
+        self.idents = {}
+        # ident -> node, for top level nodes only
+        self.top_idents = {}
+
+        nested_ids = {}
+        for element in root:
+            ident = element.get("ident")
+            if ident is not None:
+                self.top_idents.setdefault(ident, element)
+                self.idents.setdefault(ident, element)
+            element_id = element.get("id")
+            if element_id is not None:
+                self.ids.setdefault(element_id, element)
+            for child in element:
+                child_ident = child.get("ident")
+                if child_ident is not None:
+                    self.idents.setdefault(child_ident, child)
+                child_id = child.get("id")
+                if child_id is not None:
+                    nested_ids.setdefault(child_id, child)
+
+        for child_id, child in nested_ids.items():
+            self.ids.setdefault(child_id, child)
+
+    def build_lines(self):
+        entries = []
+        for position, element in enumerate(self.root):
+            start_line = element.get("start-line")
+            if start_line is not None:
+                entries.append((int(start_line), position, element))
+        entries.sort(key=lambda entry: entry[:2])
+        self.line_starts = array("i", [entry[0] for entry in entries])
+        self.line_positions = array("i", [entry[1] for entry in entries])
+        self.line_nodes = [entry[2] for entry in entries]
+
+    def span(self, first, last) -> list:
+        """
+        Top level nodes starting on a line in [first, last), the line index is built on first use
+        :return: list of nodes in document order
+        """
+        if self.line_starts is None:
+            self.build_lines()
+        lo = bisect_left(self.line_starts, first)
+        hi = bisect_left(self.line_starts, last, lo)
+        if hi <= lo:
+            return []
+        positions = sorted(range(lo, hi), key=self.line_positions.__getitem__)
+        return [self.line_nodes[i] for i in positions]
+
+
+class SymbolIndex(object):
+    """
+    Index of the top level identifiers of every tree, and of the nodes of each loaded tree.
+    Trees can be declared with their identifiers only, they are loaded through <loader>
+    the first time one of their identifiers is looked up.
+    """
+
+    def __init__(self, loader=None):
+        self.loader = loader
+        self.roots = {}
+        self.symbols = {}
+        self.loaded = {}
+        self.declared = []
+
+    def root_index(self, root) -> RootIndex:
+        """
+        Lookup tables of a root, built on first use
+        :return: RootIndex
+        """
+        index = self.roots.get(root)
+        if index is None:
+            index = RootIndex(root)
+            self.roots[root] = index
+        return index
+
+    def declare(self, xml_file, idents):
+        """
+        Register the top level identifiers of a tree without loading it, the first tree defining an identifier wins
+        """
+        self.declared.append(xml_file)
+        for ident in idents:
+            self.symbols.setdefault(ident, xml_file)
+
+    def add(self, root, xml_file):
+        """
+        Register a loaded tree and its top level identifiers
+        """
+        self.loaded[xml_file] = root
+        self.declare(xml_file, self.root_index(root).top_idents)
+
+    def lookup(self, ident):
+        """
+        Find the tree defining ident at its top level, loading it if needed
+        :return: (xml file, root) or None
+        """
+        xml_file = self.symbols.get(ident)
+        if xml_file is None:
+            return None
+        root = self.loaded.get(xml_file)
+        if root is None:
+            root = self.loader(xml_file)
+            self.loaded[xml_file] = root
+        return xml_file, root
+
+    @property
+    def unopened(self) -> list:
+        """Declared trees that were never loaded"""
+        return [xml_file for xml_file in self.declared if xml_file not in self.loaded]
@@ -0,0 +1,196 @@
+# Module : Typegraph.py
+# Description : Compact, array backed store of the c2xml type graph, with a binary sidecar file
+from array import array
+import os
+import struct
+import sys
+import xml.etree.ElementTree as ET
+
+MAGIC = b"S2STG001"
+HEADER = struct.Struct("<8sQQIIII")
+
+
+class Node(object):
+    """Read only view of a node of a TypeGraph, exposing the subset of the ElementTree API used by Descriptions"""
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and self.graph is other.graph and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.graph), self.index))
+
+    def __repr__(self):
+        return "<Node '%s' at %d>" % (self.tag, self.index)
+
+    def __len__(self):
+        return self.graph.child_count[self.index]
+
+    def __iter__(self):
+        graph = self.graph
+        start = graph.child_start[self.index]
+        for position in range(start, start + graph.child_count[self.index]):
+            yield Node(graph, graph.children[position])
+
+    @property
+    def tag(self):
+        return self.graph.strings[self.graph.tags[self.index]]
+
+    def get(self, key, default=None):
+        graph = self.graph
+        key_id = graph.string_ids.get(key)
+        if key_id is None:
+            return default
+        attrs = graph.attrs
+        start = graph.attr_start[self.index] * 2
+        for position in range(start, start + graph.attr_count[self.index] * 2, 2):
+            if attrs[position] == key_id:
+                return graph.strings[attrs[position + 1]]
+        return default
+
+    def items(self):
+        graph = self.graph
+        start = graph.attr_start[self.index] * 2
+        return [(graph.strings[graph.attrs[position]], graph.strings[graph.attrs[position + 1]])
+                for position in range(start, start + graph.attr_count[self.index] * 2, 2)]
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    @property
+    def attrib(self):
+        return dict(self.items())
+
+
+class TypeGraph(object):
+    """
+    c2xml output as flat integer arrays: every tag, attribute name and value is an index in an
+    interned string table, attributes and children of a node are contiguous ranges.
+    Node 0 is the root of the document.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.tags = array("i")
+        self.attr_start = array("i")
+        self.attr_count = array("i")
+        self.child_start = array("i")
+        self.child_count = array("i")
+        self.attrs = array("i")
+        self.children = array("i")
+
+    def getroot(self) -> Node:
+        return Node(self, 0)
+
+    def intern(self, value) -> int:
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(sys.intern(value))
+            self.string_ids[value] = string_id
+        return string_id
+
+    @classmethod
+    def from_xml(cls, xml_file):
+        """
+        Convert a c2xml file, streaming it so that the ElementTree is never held in memory
+        :return: TypeGraph
+        """
+        graph = cls()
+        # (index, children) of the nodes that are still open
+        pending = []
+        root = None
+        for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+            if event == "start":
+                index = len(graph.tags)
+                if pending:
+                    pending[-1][1].append(index)
+                else:
+                    root = elem
+                pending.append((index, []))
+                graph.tags.append(graph.intern(elem.tag))
+                graph.attr_start.append(len(graph.attrs) // 2)
+                graph.attr_count.append(len(elem.attrib))
+                for key, value in elem.attrib.items():
+                    graph.attrs.append(graph.intern(key))
+                    graph.attrs.append(graph.intern(value))
+                graph.child_start.append(0)
+                graph.child_count.append(0)
+                continue
+            index, children = pending.pop()
+            graph.child_start[index] = len(graph.children)
+            graph.child_count[index] = len(children)
+            graph.children.extend(children)
+            if len(pending) == 1:
+                root.clear()
+        return graph
+
+    def save(self, path, stamp=(0, 0)):
+        """
+        Write the graph to a binary sidecar file, stamped with the size and mtime of the XML it came from
+        """
+        blob = b"\0".join(string.encode("utf-8") for string in self.strings)
+        arrays = [self.tags, self.attr_start, self.attr_count, self.child_start, self.child_count, self.attrs,
+                  self.children]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as fd:
+            fd.write(HEADER.pack(MAGIC, stamp[0], stamp[1], len(self.tags), len(self.attrs), len(self.children),
+                                 len(blob)))
+            for values in arrays:
+                if sys.byteorder != "little":
+                    values = array("i", values)
+                    values.byteswap()
+                fd.write(values.tobytes())
+            fd.write(blob)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, stamp=(0, 0)):
+        """
+        Read a sidecar file written by save
+        :return: TypeGraph, or None if the file is missing or stale
+        """
+        try:
+            with open(path, "rb") as fd:
+                data = fd.read()
+        except IOError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, size, mtime, nodes, attrs, children, blob_size = HEADER.unpack_from(data)
+        if magic != MAGIC or (size, mtime) != tuple(stamp):
+            return None
+
+        graph = cls()
+        offset = HEADER.size
+        for name, count in (("tags", nodes), ("attr_start", nodes), ("attr_count", nodes), ("child_start", nodes),
+                            ("child_count", nodes), ("attrs", attrs), ("children", children)):
+            values = array("i")
+            values.frombytes(data[offset:offset + count * values.itemsize])
+            if sys.byteorder != "little":
+                values.byteswap()
+            setattr(graph, name, values)
+            offset += count * values.itemsize
+        graph.strings = [sys.intern(string.decode("utf-8")) for string in data[offset:offset + blob_size].split(b"\0")]
+        graph.string_ids = {string: string_id for string_id, string in enumerate(graph.strings)}
+        return graph
+
+    @classmethod
+    def for_xml(cls, xml_file):
+        """
+        Load the graph of a c2xml file from its sidecar, converting the XML if the sidecar is missing or stale
+        :return: TypeGraph
+        """
+        stat = os.stat(xml_file)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        sidecar = xml_file[:-4] + ".tg"
+        graph = cls.load(sidecar, stamp)
+        if graph is None:
+            graph = cls.from_xml(xml_file)
+            graph.save(sidecar, stamp)
+        return graph
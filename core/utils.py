@@ -31,6 +31,29 @@ class Utils(object):
                 exit(0)
             return False
 
+    @staticmethod
+    def find_files(path, suffixes) -> list:
+        """
+        Recursively list the files under path ending with one of suffixes, hidden entries are skipped
+        :return: sorted list of paths relative to path
+        """
+        found = []
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.endswith(tuple(suffixes)) and entry.is_file():
+                            found.append(os.path.relpath(entry.path, path))
+            except OSError as e:
+                logging.warning("[+] Unable to list %s: %s" % (current, e))
+        return sorted(found)
+
     @staticmethod
     def compile_file(file, args, exit=False):
         # TODO: complete this
@@ -72,11 +95,13 @@ class Utils(object):
     def run_cmd(self, command, env=ENV_NONE, doexit=False):
         try:
             subprocess.check_call(command, env=self.get_env(env), shell=True, cwd=self.cwd)
+            return True
         except Exception as e:
             logging.exception(e)
             logging.critical("Unable to run command : {}".format(command))
             if doexit:
                 exit(-1)
+        return False
 
     def run_silent_cmd(self, command, env=ENV_NONE, doexit=False):
         try:
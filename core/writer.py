@@ -0,0 +1,52 @@
+# Module : Writer.py
+# Description : Streams the generated descriptions to their output file chunk by chunk
+import os
+
+
+def join_sections(sections):
+    """
+    Chunks of the sections separated by empty lines, like "\n".join() on the sections as strings
+    :return: generator of str
+    """
+    for i, section in enumerate(sections):
+        if i:
+            yield "\n"
+        for chunk in section:
+            yield chunk
+
+
+class DescriptionWriter(object):
+    """
+    Writes descriptions through a buffered file handle as they are produced, next to the output file,
+    which is only replaced once everything was written: a failed run never leaves a truncated file.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.fd = open(self.tmp_path, "w", buffering=buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def write(self, chunks):
+        for chunk in chunks:
+            self.fd.write(chunk)
+
+    def close(self):
+        self.fd.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.fd.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
@@ -7,6 +7,7 @@ from core.extractor import Extractor, Ioctl
 from core.c2xml import *
 from core.descriptions import *
 from core.syscall import *
+from core.decisions import Decisions, POLICIES
 
 # Default imports 
 import argparse
@@ -20,14 +21,29 @@ class Sys2syz(object):
     LINUX = 2
     supported_os = {'netbsd': NETBSD, 'linux': LINUX}
 
-    def __init__(self, input_type, target, compile_commands, os_name, log_level, ioctl_trap_prefix=None):
+    def __init__(self, input_type, target, compile_commands, os_name, log_level, ioctl_trap_prefix=None, jobs=None,
+                 use_cache=True, compile_commands_index=False, c2xml_timeout=None,
+                 typegraph=False, tu_cache_mb=1024, ast_cache_mb=2048, batch_policy=None, answers_file=None,
+                 max_type_depth=None):
         self.typedefs = []
         self.input_type = input_type
         self.compile_commands = compile_commands
+        self.compile_commands_index = compile_commands_index
         self.os = os_name.lower()
         self.os_type = self.supported_os[self.os]
         self.log_level = log_level
+        self.jobs = jobs if jobs else os.cpu_count()
+        self.use_cache = use_cache
+        self.c2xml_timeout = c2xml_timeout
+        self.typegraph = typegraph
+        self.tu_cache_mb = tu_cache_mb
+        self.ast_cache_mb = ast_cache_mb
+        self.batch_policy = batch_policy
+        self.answers_file = answers_file
+        self.max_type_depth = max_type_depth
+        self.decisions = Decisions(self)
         self.defines_dict = {}
+        self.xml_trees = {}
         if not exists(os.path.join(os.getcwd(), "out/", self.os, "preprocessed/")):
             os.makedirs(os.path.join(os.getcwd(), "out/", self.os, "preprocessed/"))
 
@@ -45,6 +61,7 @@ class Sys2syz(object):
             self.extractor = Extractor(self)
             self.descriptions = Descriptions(self)
             self.header_files = self.extractor.header_files
+            self.outside_headers = self.extractor.outside_headers
             logging.debug("[+] Sys2syz init completed")
 
         if input_type == "syscall":
@@ -135,8 +152,7 @@ class Sys2syz(object):
 
     def create_xml_files(self):
         try:
-            self.c2xml.run_c2xml()
-            return True
+            return self.c2xml.run_c2xml()
         except Exception as e:
             logging.critical("Failed to convert C files to XML")
         return False
@@ -187,13 +203,37 @@ def main():
     parser.add_argument("-c", "--compile-commands", help="path to compile_commands.json", type=str, required=True)
     parser.add_argument("-v", "--verbosity", help="sys2syz log level", action="count")
     parser.add_argument("-px", "--ioctl-trap-prefix", help="trap prefix for linux", type=str, required=False, default=None)
+    parser.add_argument("-j", "--jobs", help="number of parallel jobs (defaults to the number of cores)", type=int,
+                        required=False, default=os.cpu_count())
+    parser.add_argument("--no-cache", help="rebuild intermediate files even if they are up to date",
+                        action="store_true")
+    parser.add_argument("--c2xml-timeout", help="seconds before a single c2xml conversion is abandoned", type=int,
+                        required=False, default=600)
+    parser.add_argument("--typegraph", help="generate descriptions from compact type graphs instead of XML trees",
+                        action="store_true")
+    parser.add_argument("--tu-cache-mb", help="preprocessed megabytes of translation units kept parsed by libclang",
+                        type=int, required=False, default=1024)
+    parser.add_argument("--ast-cache-mb", help="megabytes of saved libclang ASTs kept on disk between runs",
+                        type=int, required=False, default=2048)
+    parser.add_argument("--batch-policy", help="answer every prompt without user input", choices=POLICIES,
+                        required=False, default=None)
+    parser.add_argument("--answers", help="file replaying and recording the answers to the prompts", type=str,
+                        required=False, default=None)
+    parser.add_argument("--max-type-depth", help="pointers followed from an argument before the pointed to type "
+                                                 "becomes int64 (unlimited by default)", type=int, required=False,
+                        default=None)
+    parser.add_argument("--compile-commands-index", help="keep an on-disk index of compile_commands.json entries",
+                        action="store_true")
     args = parser.parse_args()
 
     logging = get_logger("Syz2syz", args.verbosity)
 
     # get the header files
     sysobj = Sys2syz(args.input_type, args.target, args.compile_commands, args.operating_system, args.verbosity,
-                     args.ioctl_trap_prefix)
+                     args.ioctl_trap_prefix, args.jobs, not args.no_cache,
+                     args.compile_commands_index, args.c2xml_timeout,
+                     args.typegraph, args.tu_cache_mb, args.ast_cache_mb,
+                     args.batch_policy, args.answers, args.max_type_depth)
 
     if sysobj.input_type == "ioctl":
 